@@ -0,0 +1,108 @@
+import json
+import time
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+
+from rest_framework.renderers import BaseRenderer
+
+from employees.cache_stamps import get_stamp, bump_stamps
+from .models import ClientComment
+
+
+FEED_PAGE_SIZE = getattr(settings, 'CLIENT_COMMENT_FEED_PAGE_SIZE', 100)
+
+# a stream holds a sync worker for up to MAX_DURATION, it is only enabled
+# where it is served by ASGI or a dedicated process, clients poll
+# comments-since otherwise
+STREAM_ENABLED = getattr(settings, 'CLIENT_COMMENT_STREAM_ENABLED', False)
+
+# seconds between checks of the thread stamp by an open stream
+POLL_INTERVAL = getattr(settings, 'CLIENT_COMMENT_STREAM_POLL_INTERVAL', 2)
+HEARTBEAT_INTERVAL = getattr(settings, 'CLIENT_COMMENT_STREAM_HEARTBEAT', 15)
+
+# seconds after which a stream queries the database even though the stamp
+# did not change, bounds the delay when the cache is not shared between
+# processes and stamps bumped by other workers are never seen
+RECHECK_INTERVAL = getattr(settings, 'CLIENT_COMMENT_STREAM_RECHECK_INTERVAL', 30)
+
+# a stream holds a worker, it is closed after this many seconds and the
+# browser reconnects from the last event id
+MAX_DURATION = getattr(settings, 'CLIENT_COMMENT_STREAM_MAX_DURATION', 300)
+
+
+class EventStreamRenderer(BaseRenderer):
+    """Lets EventSource requests through content negotiation, error
+    responses are rendered as json
+    """
+    media_type = 'text/event-stream'
+    format = 'event-stream'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return json.dumps(data, cls=DjangoJSONEncoder).encode(self.charset)
+
+
+def stamp_key(client_id):
+    return 'client-comments-stamp:%s' % client_id
+
+
+def bump_comment_stamp(client_id):
+    """Marks the comment thread of a client as changed once the current
+    transaction commits
+    """
+    transaction.on_commit(lambda: bump_stamps([stamp_key(client_id)]))
+
+
+def comment_stamp(client_id):
+    return get_stamp(stamp_key(client_id))
+
+
+def comments_since(client, after_id, limit=FEED_PAGE_SIZE):
+    """comments of client with an id above after_id, oldest first
+    """
+    return list(ClientComment.objects.filter(
+        client=client, id__gt=after_id
+    ).select_related('client', 'created_by').order_by('id')[:limit])
+
+
+def comment_events(client, after_id, serialize):
+    """Yields server sent events for comments of client newer than after_id
+
+    The database is queried when the thread stamp changed and at least every
+    RECHECK_INTERVAL seconds, an idle thread costs one cache read per
+    POLL_INTERVAL. New comments show up within POLL_INTERVAL when the default
+    cache is shared between processes and within RECHECK_INTERVAL otherwise
+
+    Each open stream ties up a sync worker until MAX_DURATION, see
+    STREAM_ENABLED
+    """
+    started = last_event = last_check = time.monotonic()
+    stamp = object()
+
+    yield 'retry: %d\n\n' % (POLL_INTERVAL * 1000)
+
+    while time.monotonic() - started < MAX_DURATION:
+        current = comment_stamp(client.id)
+
+        if current != stamp or time.monotonic() - last_check >= RECHECK_INTERVAL:
+            comments = comments_since(client, after_id)
+            last_check = time.monotonic()
+
+            for comment in comments:
+                after_id = comment.id
+                yield 'id: %d\nevent: comment\ndata: %s\n\n' % (
+                    comment.id, json.dumps(serialize(comment), cls=DjangoJSONEncoder)
+                )
+                last_event = time.monotonic()
+
+            # a full batch leaves the stamp unseen so the rest is read next
+            if len(comments) < FEED_PAGE_SIZE:
+                stamp = current
+
+        if time.monotonic() - last_event >= HEARTBEAT_INTERVAL:
+            yield ': heartbeat\n\n'
+            last_event = time.monotonic()
+
+        time.sleep(POLL_INTERVAL)
@@ -0,0 +1,41 @@
+from django.db.models import Case, When, Value, CharField
+
+from accounts.models import User
+from .models import ClientComment
+
+
+def author_name(user):
+    """Display name of a comment author, the client name for portal users,
+    the employee name for employees and the user profile name for owners
+    """
+    profile = None
+
+    if hasattr(user, 'client_user'):
+        profile = user.client_user
+    elif not user.is_superuser:
+        profile = user.employee_user.first()
+
+    if profile is None:
+        profile = user.user_profile
+
+    return profile.first_name + ' ' + profile.last_name
+
+
+def refresh_author_names(user_ids):
+    """Rewrites the stored author name of every comment of the given users
+    with a single UPDATE
+    """
+    user_ids = set(user_ids)
+
+    if not user_ids:
+        return
+
+    users = User.objects.filter(id__in=user_ids).select_related('client_user', 'user_profile')
+
+    names = {user.id: author_name(user) for user in users}
+
+    if names:
+        ClientComment.objects.filter(created_by_id__in=names).update(commented_by_name=Case(
+            *[When(created_by_id=user_id, then=Value(name)) for user_id, name in names.items()],
+            output_field=CharField()
+        ))
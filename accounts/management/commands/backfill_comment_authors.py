@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from clients.models import ClientComment
+from clients.comments import refresh_author_names
+
+
+class Command(BaseCommand):
+    help = 'Stores the author name of client comments written before it was denormalized'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='refresh every comment, not only unnamed ones')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        comments = ClientComment.objects.all()
+
+        if not options['all']:
+            comments = comments.filter(commented_by_name='')
+
+        user_ids = list(comments.order_by().values_list('created_by_id', flat=True).distinct())
+        batch_size = options['batch_size']
+
+        for start in range(0, len(user_ids), batch_size):
+            refresh_author_names(user_ids[start:start + batch_size])
+
+        self.stdout.write(self.style.SUCCESS('Refreshed comments of %d authors' % len(user_ids)))
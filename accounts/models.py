@@ -1,4 +1,5 @@
 from django.db import models
+from django.db.models import Prefetch
 from django.utils.translation import gettext_lazy as _
 
 from general.models import Base, Country, State, City
@@ -7,6 +8,7 @@ from accounts.models import User
 from general.models import PaymentTerm
 from general.currencies import currencies
 from organizations.models import Organization,Branch
+from employees.models import Employee
 
 from phonenumber_field.modelfields import PhoneNumberField
 
@@ -27,6 +29,49 @@ PAYMENT_TERMS =(
     ('hourly','Hourly'),
 )
 
+class ClientQuerySet(models.QuerySet):
+
+    def for_serializer(self, expand=None):
+        """Query plan for ClientSerializer, the whole client bundle including
+        projects, billable resources, their employees, contracts and terms is
+        loaded with a fixed number of queries
+
+        expand lists the sections of the bundle to load, the joins and
+        prefetches of the other sections are skipped
+        """
+        def expanded(section):
+            return expand is None or section in expand
+
+        related = ['organization', 'branch', 'department']
+        prefetches = []
+
+        if expanded('otherdetails'):
+            related.append('otherdetails')
+
+        if expanded('billing_address'):
+            related.extend(['address__country', 'address__state', 'address__city'])
+
+        if expanded('shipping_address'):
+            related.append('shippingaddress')
+
+        if expanded('remark'):
+            related.append('remark')
+
+        if expanded('contact_persons'):
+            prefetches.append('contactperson_set')
+
+        if expanded('projects'):
+            resources = 'project_set__financialinfo__resource_set'
+            prefetches.extend([
+                'project_set__financialinfo__termattachment_set',
+                resources,
+                Prefetch(resources + '__resource_assigned', queryset=Employee.objects.for_serializer()),
+                resources + '__resource_assigned__get_contract',
+            ])
+
+        return self.select_related(*related).prefetch_related(*prefetches)
+
+
 class Client(Base):
     """
     Client model associated with details of a client
@@ -48,6 +93,8 @@ class Client(Base):
     client_display_name = models.CharField(max_length=128, null=True, blank=True)
     work_phone = models.CharField(max_length=20, blank=True)
 
+    objects = ClientQuerySet.as_manager()
+
     def __str__(self):
         return self.first_name +" "+ self.last_name
 
@@ -135,4 +182,12 @@ class ClientComment(Base):
     Comment model associated with comments about the client
     """
     client = models.ForeignKey(Client, on_delete=models.CASCADE)
-    comment = models.TextField()
\ No newline at end of file
+    comment = models.TextField()
+    # display name of created_by, kept in sync with renames by clients.signals
+    commented_by_name = models.CharField(max_length=257, blank=True)
+
+    class Meta(Base.Meta):
+        indexes = [
+            models.Index(fields=['client', '-created']),
+            models.Index(fields=['client', 'id']),
+        ]
@@ -3,24 +3,28 @@ import uuid
 
 
 from django.utils.text import slugify
+from django.db import transaction
+from django.db.models import Case, When, Value
 from collections import OrderedDict
 
 from rest_framework import serializers
 from .models import *
 from departments.models import *
-from general.validators import is_postcode_valid
 from general.models import Base, Country, State, City
 from django.template.loader import render_to_string
-from django.core.mail import send_mail
-from django.conf import settings
 from projects.serializers import ProjectSerializer ,ResourceSerializer, ContractAttachmentsSerializer, TermAttachmentSerializer
 from employees.serializers import EmployeeSerializer
+from employees.outbox import queue_email
+from employees.login import password_changed
+from employees.geo import geo_index, postcode_valid
+from departments.fieldsets import SparseFieldsetMixin
+from .comments import author_name
 
 
 from phonenumber_field.serializerfields import PhoneNumberField
 
 
-class ClientSerializer(serializers.ModelSerializer):
+class ClientSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
   
     organization = serializers.SlugRelatedField(queryset=Organization.objects.all(), slug_field='slug')
     branch = serializers.SlugRelatedField(queryset=Branch.objects.all(), slug_field='slug', allow_null=True)
@@ -33,6 +37,11 @@ class ClientSerializer(serializers.ModelSerializer):
          fields = ['slug','organization', 'branch', 'department','salutation','first_name','last_name','company_name',
          'email','mobile','work_phone','website','client_type','client_display_name','photo']
          read_only_fields = ['slug']
+
+    # sections of the bundle next to the client fields, fields= and expand=
+    # pick both the client fields and the sections
+    expandable_fields = ('otherdetails', 'billing_address', 'shipping_address', 'remark',
+        'contact_persons', 'projects')
     
     def create(self, validated_data):
 
@@ -52,9 +61,9 @@ class ClientSerializer(serializers.ModelSerializer):
         data = super().to_representation(obj)
         fulldata = OrderedDict()
         fulldata['client']=data
-        if hasattr(obj,'otherdetails'):
+        if self.should_expand('otherdetails') and hasattr(obj,'otherdetails'):
             fulldata['otherdetails']=OtherDetailsSerializer(obj.otherdetails).data
-        if hasattr(obj,'address'):
+        if self.should_expand('billing_address') and hasattr(obj,'address'):
             fulldata['billing_address']=AddressSerializer(obj.address).data
             if hasattr(obj.address,'country'):
                 fulldata['billing_address']['country']={
@@ -72,20 +81,25 @@ class ClientSerializer(serializers.ModelSerializer):
                 'name_ascii': obj.address.city.name_ascii
                 }
             
-        if hasattr(obj,'shippingaddress'):
+        if self.should_expand('shipping_address') and hasattr(obj,'shippingaddress'):
             fulldata['shipping_address']=ShippingAddressSerializer(obj.shippingaddress).data
-        if hasattr(obj,'remark'):
+        if self.should_expand('remark') and hasattr(obj,'remark'):
             fulldata['remark']=RemarkSerializer(obj.remark).data
-        if hasattr(obj,'contactperson_set'):
+        if self.should_expand('contact_persons') and hasattr(obj,'contactperson_set'):
             fulldata['contact_persons']=ContactPersonSerializer(obj.contactperson_set.all(),many=True).data
             
-        if hasattr(obj,'project_set'):
+        if self.should_expand('projects') and hasattr(obj,'project_set'):
                        
             projects=[]
             
             for i in obj.project_set.all():
                 resources=[]
-                for res_obj in i.financialinfo.resource_set.all().filter(resource_billing_type='billable'):
+                # filtering in python keeps prefetched resources and terms in use
+                billable_resources=[
+                    res_obj for res_obj in i.financialinfo.resource_set.all()
+                    if res_obj.resource_billing_type=='billable'
+                ]
+                for res_obj in billable_resources:
 
                     resources_assigned=EmployeeSerializer(res_obj.resource_assigned).data
                     res=ResourceSerializer(res_obj).data
@@ -96,8 +110,9 @@ class ClientSerializer(serializers.ModelSerializer):
                         contracts.append(ContractAttachmentsSerializer(cont).data)   
                     res['contracts']=contracts
                     terms=[]
-                    for term in i.financialinfo.termattachment_set.filter(resource=res_obj.resource_assigned):
-                        terms.append(TermAttachmentSerializer(term).data)
+                    for term in i.financialinfo.termattachment_set.all():
+                        if term.resource_id==res_obj.resource_assigned_id:
+                            terms.append(TermAttachmentSerializer(term).data)
                     res['terms']=terms
                     resources.append(res)
 
@@ -145,12 +160,10 @@ class OtherDetailsSerializer(serializers.ModelSerializer):
 
             subject = client.organization.organization_name + ' has Invited to you join the portal'
 
-            send_mail(subject,
-                '',
-                settings.DEFAULT_FROM_EMAIL,
+            queue_email(subject,
                 [client.email],
                 html_message = html_message,
-                fail_silently=False
+                reference = 'client-portal-invitation:%s' % client.slug
             )
 
         else:
@@ -167,6 +180,7 @@ class OtherDetailsSerializer(serializers.ModelSerializer):
         if validated_data['enable_portal'] and instance.client.user.password:
             instance.client.user.is_active=True
             instance.client.user.save()
+            password_changed(instance.client.user.email)
         
         elif validated_data['enable_portal'] and not instance.client.user.password:
             # portal_password=self.context['request'].GET.get('portal_password')
@@ -187,12 +201,10 @@ class OtherDetailsSerializer(serializers.ModelSerializer):
 
             subject = instance.client.organization.organization_name + ' has Invited to you join the portal'
 
-            send_mail(subject,
-                '',
-                settings.DEFAULT_FROM_EMAIL,
+            queue_email(subject,
                 [instance.client.email],
                 html_message = html_message,
-                fail_silently=False
+                reference = 'client-portal-invitation:%s' % instance.client.slug
             )
             print('enable portal is True & no portal password')
 
@@ -227,10 +239,10 @@ class AddressSerializer(serializers.ModelSerializer):
         pin_code = data.get("pin_code")
 
         if state:
-            state_exists = State.objects.filter(
-                pk=state.pk, 
-                country=country
-            ).exists()
+            state_exists = geo_index.state_in_country(
+                state.pk, 
+                country.pk if country else None
+            )
         
             if not state_exists:
                 raise serializers.ValidationError({
@@ -238,10 +250,10 @@ class AddressSerializer(serializers.ModelSerializer):
                     })
 
         if city:
-            city_exists = City.objects.filter(
-                pk=city.pk, 
-                region=state
-            ).exists()
+            city_exists = geo_index.city_in_state(
+                city.pk, 
+                state.pk if state else None
+            )
 
             if not city_exists:
                 raise serializers.ValidationError({
@@ -251,7 +263,7 @@ class AddressSerializer(serializers.ModelSerializer):
         # validating postal code related to country
         if pin_code and country:
 
-            if not is_postcode_valid(pin_code, country.code2):
+            if not postcode_valid(pin_code, country.code2):
 
                 raise serializers.ValidationError("Invalid pincode")
         return data
@@ -325,10 +337,10 @@ class ShippingAddressSerializer(serializers.ModelSerializer):
         pin_code = data.get("shipping_pin_code")
 
         if state:
-            state_exists = State.objects.filter(
-                pk=state.pk, 
-                country=country
-            ).exists()
+            state_exists = geo_index.state_in_country(
+                state.pk, 
+                country.pk if country else None
+            )
         
             if not state_exists:
                 raise serializers.ValidationError({
@@ -336,10 +348,10 @@ class ShippingAddressSerializer(serializers.ModelSerializer):
                     })
 
         if city:
-            city_exists = City.objects.filter(
-                pk=city.pk, 
-                region=state
-            ).exists()
+            city_exists = geo_index.city_in_state(
+                city.pk, 
+                state.pk if state else None
+            )
 
             if not city_exists:
                 raise serializers.ValidationError({
@@ -349,7 +361,7 @@ class ShippingAddressSerializer(serializers.ModelSerializer):
         # validating postal code related to country
         if pin_code and country:
 
-            if not is_postcode_valid(pin_code, country.code2):
+            if not postcode_valid(pin_code, country.code2):
 
                 raise serializers.ValidationError("Invalid pincode")
         return data
@@ -376,23 +388,106 @@ class RemarkSerializer(serializers.ModelSerializer):
         return instance
 
 
+class ContactPersonListSerializer(serializers.ListSerializer):
+    """creates the contact persons of a client with a single insert, saving
+    with the existing contact persons as instance replaces them with the
+    submitted list
+    """
+
+    def create(self, validated_data):
+        contact_persons = []
+        for attrs in validated_data:
+            attrs.pop('id', None)
+            contact_persons.append(ContactPerson(**attrs))
+
+        return ContactPerson.objects.bulk_create(contact_persons)
+
+    def update(self, instance, validated_data):
+        """diffs the submitted list against instance, rows are matched by id
+        and then by email, only new, changed and removed rows are written
+        """
+        unmatched = OrderedDict((contact_person.id, contact_person) for contact_person in instance)
+
+        matches = [unmatched.pop(attrs.pop('id', None), None) for attrs in validated_data]
+
+        by_email = {}
+        for contact_person in unmatched.values():
+            if contact_person.contactperson_email:
+                by_email.setdefault(contact_person.contactperson_email.lower(), contact_person)
+
+        for index, attrs in enumerate(validated_data):
+            email = (attrs.get('contactperson_email') or '').lower()
+            if matches[index] is None and email in by_email:
+                matches[index] = by_email.pop(email)
+                del unmatched[matches[index].id]
+
+        contact_persons = []
+        new_rows = []
+        changed_rows = []
+        changed_fields = set()
+
+        for attrs, contact_person in zip(validated_data, matches):
+            if contact_person is None:
+                contact_person = ContactPerson(**attrs)
+                new_rows.append(contact_person)
+            else:
+                fields = {
+                    field for field, value in attrs.items()
+                    if field != 'client' and getattr(contact_person, field) != value
+                }
+                if fields:
+                    for field in fields:
+                        setattr(contact_person, field, attrs[field])
+                    changed_rows.append(contact_person)
+                    changed_fields |= fields
+
+            contact_persons.append(contact_person)
+
+        with transaction.atomic():
+            if unmatched:
+                ContactPerson.objects.filter(id__in=list(unmatched)).delete()
+
+            if changed_rows:
+                ContactPerson.objects.filter(id__in=[row.id for row in changed_rows]).update(**{
+                    field: Case(
+                        *[When(id=row.id, then=Value(getattr(row, field))) for row in changed_rows],
+                        output_field=ContactPerson._meta.get_field(field)
+                    )
+                    for field in changed_fields
+                })
+
+            if new_rows:
+                ContactPerson.objects.bulk_create(new_rows)
+
+        return contact_persons
+
+
 class ContactPersonSerializer(serializers.ModelSerializer):
     # contactperson_mobile_number = PhoneNumberField(allow_blank=True, allow_null=True)
     # contactperson_work_phone_number = PhoneNumberField(allow_blank=True, allow_null=True)
 
+    id = serializers.IntegerField(required=False)
+
     class Meta:
         model= ContactPerson
         fields =[
-            'contactperson_salutation','contactperson_first_name','contactperson_last_name','contactperson_email',
+            'id','contactperson_salutation','contactperson_first_name','contactperson_last_name','contactperson_email',
             'contactperson_mobile_number','contactperson_skype_name'
         ]
+        list_serializer_class = ContactPersonListSerializer
 
     def create(self,validated_data):
         client = validated_data.pop('client')
+        validated_data.pop('id', None)
         contact_person=ContactPerson(**validated_data)
         contact_person.client=client
         contact_person.save()
         return contact_person
+
+    def update(self, instance, validated_data):
+        # id only identifies rows of a replaced list
+        validated_data.pop('id', None)
+        return super().update(instance, validated_data)
     
     
 class ClientCommentSerializer(serializers.ModelSerializer):
@@ -408,12 +503,9 @@ class ClientCommentSerializer(serializers.ModelSerializer):
     def to_representation(self, obj):
         data = super().to_representation(obj)
         data['comment']=obj.comment
-        if hasattr(obj.created_by,'client_user'):
-            data['commented_by']=obj.created_by.client_user.first_name + ' ' + obj.created_by.client_user.last_name
-        elif hasattr(obj.created_by,'employee_user') and not obj.created_by.is_superuser:
-            data['commented_by']=obj.created_by.employee_user.first().first_name + ' ' + obj.created_by.employee_user.first().last_name
-        else:
-            data['commented_by']=obj.created_by.user_profile.first_name + ' ' + obj.created_by.user_profile.last_name
+        # stored at write time, comments older than the column are filled by
+        # the backfill_comment_authors command
+        data['commented_by']=obj.commented_by_name or author_name(obj.created_by)
 
         data['date_time']=timezone.localtime(obj.created).strftime("%A %d. %B %Y %H:%M %p")
 
@@ -425,6 +517,7 @@ class ClientCommentSerializer(serializers.ModelSerializer):
         client_comment.client=client
         client_comment.created_by=self.context['request'].user
         client_comment.updated_by=self.context['request'].user
+        client_comment.commented_by_name=author_name(self.context['request'].user)
         client_comment.slug = slugify(uuid.uuid4())
         client_comment.save()
         return client_comment
@@ -441,6 +534,14 @@ class ClientCommentListSerializer(serializers.ModelSerializer):
             'client'
         ]
 
+class ClientCommentFeedSerializer(serializers.Serializer):
+    """
+    serializer for reading comments of a client newer than after_id
+    """
+    client = serializers.SlugRelatedField(queryset=Client.objects.all(), slug_field='slug')
+    after_id = serializers.IntegerField(min_value=0, default=0)
+
+
 class ClientListSerializer(serializers.ModelSerializer):
     """
     Serializer for client listing according to organization
@@ -0,0 +1,55 @@
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from accounts.models import User
+from employees.models import Employee
+from .models import Client, ClientComment
+from .comments import refresh_author_names
+from .comment_feed import bump_comment_stamp
+
+
+# profile model of the accounts app, reached through the user_profile
+# reverse one to one of User
+UserProfile = User.user_profile.related.related_model
+PROFILE_USER_ATTNAME = User.user_profile.related.field.attname
+
+
+NAME_FIELDS = {'first_name', 'last_name'}
+
+
+@receiver(pre_save, sender=Client)
+@receiver(pre_save, sender=Employee)
+@receiver(pre_save, sender=UserProfile)
+def remember_name_change(sender, instance, raw=False, update_fields=None, **kwargs):
+    instance._name_changed = False
+
+    if raw or instance.pk is None:
+        return
+
+    if update_fields is not None and not NAME_FIELDS.intersection(update_fields):
+        return
+
+    saved_name = sender.objects.filter(pk=instance.pk).values_list('first_name', 'last_name').first()
+    instance._name_changed = saved_name is not None and saved_name != (instance.first_name, instance.last_name)
+
+
+@receiver(post_save, sender=Client)
+@receiver(post_save, sender=Employee)
+@receiver(post_save, sender=UserProfile)
+def refresh_comment_author_names(sender, instance, created=False, raw=False, **kwargs):
+    if raw or created or not getattr(instance, '_name_changed', False):
+        return
+
+    user_id = getattr(instance, PROFILE_USER_ATTNAME if sender is UserProfile else 'user_id')
+
+    if user_id:
+        refresh_author_names([user_id])
+
+
+@receiver(post_save, sender=ClientComment)
+@receiver(post_delete, sender=ClientComment)
+def bump_client_comment_stamp(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+
+    bump_comment_stamp(instance.client_id)
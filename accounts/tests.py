@@ -0,0 +1,230 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from employees.tests import create_user, create_organization, create_employee
+from projects.models import Project, FinancialInfo, Resource
+from .models import Client, ClientComment, ContactPerson
+from .serializers import ClientSerializer
+from .views import ClientCommentViewSet, ContactPersonsViewset
+
+
+def create_client(organization, email='client@example.com', first_name='Jane', last_name='Roe'):
+    owner = organization.created_by
+    return Client.objects.create(
+        organization=organization, salutation='ms', first_name=first_name, last_name=last_name,
+        email=email, client_type='individual', created_by=owner, updated_by=owner
+    )
+
+
+def create_comment(client, user, comment='comment'):
+    return ClientComment.objects.create(
+        client=client, comment=comment, created_by=user, updated_by=user
+    )
+
+
+def create_project(client, name, employees):
+    owner = client.created_by
+    project = Project.objects.create(
+        client=client, project_name=name, slug=name.lower(), created_by=owner, updated_by=owner
+    )
+    financial_info = FinancialInfo.objects.create(project=project)
+
+    for employee in employees:
+        Resource.objects.create(
+            financial_info=financial_info, resource_assigned=employee, resource_billing_type='billable'
+        )
+
+    return project
+
+
+class ClientTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.owner = create_user('owner@example.com', is_superuser=True)
+        self.organization = create_organization(self.owner)
+        self.client_obj = create_client(self.organization)
+
+    def call(self, action, method='post', data=None, **kwargs):
+        factory = APIRequestFactory()
+        request = getattr(factory, method)('/', data, **kwargs)
+        force_authenticate(request, self.owner)
+
+        return ClientCommentViewSet.as_view({method: action})(request)
+
+
+class CommentFeedTest(ClientTestCase):
+
+    def test_comments_since_returns_newer_comments_oldest_first(self):
+        first = create_comment(self.client_obj, self.owner, 'first')
+        second = create_comment(self.client_obj, self.owner, 'second')
+        third = create_comment(self.client_obj, self.owner, 'third')
+
+        response = self.call('comments_since', data={'client': self.client_obj.slug, 'after_id': first.id})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['id'] for item in response.data['response']], [second.id, third.id])
+        self.assertEqual(response.data['last_id'], third.id)
+        self.assertFalse(response.data['has_more'])
+
+    def test_stream_is_disabled_by_default(self):
+        response = self.call('comments_stream', method='get', data={'client': self.client_obj.slug})
+
+        self.assertEqual(response.status_code, 404)
+
+    @mock.patch('clients.comment_feed.STREAM_ENABLED', True)
+    @mock.patch('clients.comment_feed.MAX_DURATION', 0)
+    def test_enabled_stream_starts_with_retry_interval(self):
+        response = self.call(
+            'comments_stream', method='get', data={'client': self.client_obj.slug},
+            HTTP_ACCEPT='text/event-stream'
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'retry: '))
+
+
+class ClientCommentListTest(ClientTestCase):
+
+    def test_comments_are_a_plain_list_by_default(self):
+        create_comment(self.client_obj, self.owner, 'first')
+        create_comment(self.client_obj, self.owner, 'second')
+
+        response = self.call('clients_comments', data={'client': self.client_obj.slug})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['comment'] for item in response.data], ['second', 'first'])
+
+    def test_cursor_pages_are_opt_in(self):
+        for index in range(3):
+            create_comment(self.client_obj, self.owner, 'comment %d' % index)
+
+        factory = APIRequestFactory()
+        request = factory.post('/?pagination=cursor&page_size=2', {'client': self.client_obj.slug})
+        force_authenticate(request, self.owner)
+        response = ClientCommentViewSet.as_view({'post': 'clients_comments'})(request)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['comment'] for item in response.data['response']], ['comment 2', 'comment 1'])
+        self.assertIsNotNone(response.data['next'])
+
+
+class CommentAuthorNameTest(ClientTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client_obj.user = create_user('portal@example.com')
+        self.client_obj.save()
+        self.comment = create_comment(self.client_obj, self.client_obj.user)
+        ClientComment.objects.filter(pk=self.comment.pk).update(commented_by_name='Jane Roe')
+
+    def author_name(self):
+        return ClientComment.objects.get(pk=self.comment.pk).commented_by_name
+
+    def test_renamed_client_renames_comments(self):
+        self.client_obj.first_name = 'Janet'
+        self.client_obj.save()
+
+        self.assertEqual(self.author_name(), 'Janet Roe')
+
+    def test_save_without_name_change_does_not_refresh(self):
+        with mock.patch('clients.signals.refresh_author_names') as refresh_author_names:
+            self.client_obj.company_name = 'Roe Ltd'
+            self.client_obj.save()
+            Client.objects.get(pk=self.client_obj.pk).save(update_fields=['company_name'])
+
+        refresh_author_names.assert_not_called()
+
+
+class ClientQuerySetTest(ClientTestCase):
+
+    def serialize(self):
+        with CaptureQueriesContext(connection) as queries:
+            data = ClientSerializer(Client.objects.for_serializer().filter(pk=self.client_obj.pk), many=True).data
+
+        return data, len(queries)
+
+    def test_query_count_does_not_grow_with_projects_and_resources(self):
+        employees = [
+            create_employee(self.organization, 'employee%d@example.com' % index)
+            for index in range(3)
+        ]
+
+        create_project(self.client_obj, 'First', employees[:1])
+        data, one = self.serialize()
+        self.assertEqual(len(data[0]['projects'][0]['resources']), 1)
+
+        create_project(self.client_obj, 'Second', employees)
+        create_project(self.client_obj, 'Third', employees[1:])
+        data, many = self.serialize()
+        self.assertEqual(sum(len(project['resources']) for project in data[0]['projects']), 6)
+
+        self.assertEqual(one, many)
+
+
+class ContactPersonsTest(ClientTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.john = ContactPerson.objects.create(
+            client=self.client_obj, contactperson_salutation='mr',
+            contactperson_first_name='John', contactperson_email='john@example.com'
+        )
+
+    def send(self, action, method, contact_persons):
+        request = getattr(APIRequestFactory(), method)(
+            '/?client=%s' % self.client_obj.slug, {'contact_person': contact_persons}, format='json'
+        )
+        force_authenticate(request, self.owner)
+
+        return ContactPersonsViewset.as_view({method: action})(request)
+
+    def contact_person(self, first_name, email, **values):
+        values.update({
+            'contactperson_salutation': 'ms',
+            'contactperson_first_name': first_name,
+            'contactperson_email': email,
+        })
+        return values
+
+    def test_create_appends(self):
+        response = self.send('create', 'post', [self.contact_person('Jane', 'jane@example.com')])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            set(self.client_obj.contactperson_set.values_list('contactperson_first_name', flat=True)),
+            {'John', 'Jane'}
+        )
+
+    def test_replace_keeps_matched_rows_and_removes_the_rest(self):
+        ContactPerson.objects.create(
+            client=self.client_obj, contactperson_salutation='mr', contactperson_first_name='Old'
+        )
+
+        response = self.send('replace_contact_persons', 'put', [
+            self.contact_person('Johnny', 'JOHN@example.com'),
+            self.contact_person('Jane', 'jane@example.com'),
+        ])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            dict(self.client_obj.contactperson_set.values_list('contactperson_first_name', 'id'))['Johnny'],
+            self.john.id
+        )
+        self.assertEqual(
+            set(self.client_obj.contactperson_set.values_list('contactperson_first_name', flat=True)),
+            {'Johnny', 'Jane'}
+        )
+
+    def test_invalid_replace_changes_nothing(self):
+        response = self.send('replace_contact_persons', 'put', [{'contactperson_first_name': 'Jane'}])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(list(self.client_obj.contactperson_set.all()), [self.john])
@@ -1,14 +1,21 @@
+from django.db import transaction
+from django.http import StreamingHttpResponse
+
 from rest_framework import viewsets
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.decorators import action
+from rest_framework.pagination import CursorPagination
+from rest_framework.renderers import JSONRenderer
 
 
 from .serializers import *
 from .models import *
+from . import comment_feed
 
 from accounts.serializers import UserSerializer
+from departments.fieldsets import expanded_sections
 
 
 class ClientViewSet(viewsets.ModelViewSet):
@@ -16,6 +23,16 @@ class ClientViewSet(viewsets.ModelViewSet):
     queryset = Client.objects.all()
     lookup_field = 'slug'
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+
+        if self.action in ('list', 'retrieve'):
+            queryset = queryset.for_serializer(
+                expanded_sections(self.request, ClientSerializer.expandable_fields)
+            )
+
+        return queryset
+
     def create(self,request):
         context = { 'request': request }
 
@@ -39,13 +56,16 @@ class ClientViewSet(viewsets.ModelViewSet):
         if user_serializer_valid and client_serializer_is_valid and other_details_serializer_is_valid and address_serializer_is_valid \
             and shipping_address_serializer_valid and remark_serializer_valid and contact_person_serializer_valid:
             
-            user=user_serializer.save()
-            client=serializer.save(user=user)
-            other_details_serializer.save(client=client)
-            address_serializer.save(client=client)
-            shipping_address_serializer.save(client=client)
-            remark_serializer.save(client=client)
-            contact_person_serializer.save(client=client)
+            # one transaction for the whole bundle, the portal invitation is
+            # written to the outbox and only sent once it commits
+            with transaction.atomic():
+                user=user_serializer.save()
+                client=serializer.save(user=user)
+                other_details_serializer.save(client=client)
+                address_serializer.save(client=client)
+                shipping_address_serializer.save(client=client)
+                remark_serializer.save(client=client)
+                contact_person_serializer.save(client=client)
                         
             return Response(serializer.data)
                 
@@ -76,7 +96,8 @@ class ClientViewSet(viewsets.ModelViewSet):
         if serializer.is_valid():
             organization = serializer.validated_data.get('organization')
             # branch_slug = serializer.data.get('branch')
-            clients = Client.objects.filter(organization=organization)
+            expand = expanded_sections(request, ClientSerializer.expandable_fields)
+            clients = Client.objects.for_serializer(expand).filter(organization=organization)
             serializer = self.get_serializer(clients, many=True)
             return Response(serializer.data)
         else:
@@ -101,7 +122,9 @@ class OtherDetailsViewset(viewsets.ModelViewSet):
         serializer = self.get_serializer(obj,data=request.data,partial=True)
 
         if serializer.is_valid():
-            serializer.save()
+            # portal invitation is queued in the outbox with the update
+            with transaction.atomic():
+                serializer.save()
             return Response(serializer.data)
         else:
             return Response(serializer.errors,status=status.HTTP_400_BAD_REQUEST)
@@ -141,10 +164,11 @@ class ContactPersonsViewset(viewsets.ModelViewSet):
     queryset=ContactPerson.objects.all()
 
     def create(self, request, *args, **kwargs):
+        """adds the submitted contact persons to a client
+        """
         client=Client.objects.get(slug=self.request.GET.get('client'))
-        
-        client.contactperson_set.all().delete()
-        serializer = ContactPersonSerializer(data=request.data['contact_person'],many=True)
+
+        serializer = ContactPersonSerializer(data=request.data['contact_person'], many=True)
 
         if serializer.is_valid():
             serializer.save(client=client)
@@ -152,6 +176,34 @@ class ContactPersonsViewset(viewsets.ModelViewSet):
         else:
             return Response(serializer.errors,status=status.HTTP_400_BAD_REQUEST)
 
+    @action(methods=['put'], detail=False, url_path='replace-contact-persons')
+    def replace_contact_persons(self, request):
+        """replaces the contact persons of a client with the submitted list,
+        only new, changed and removed rows are written
+        """
+        # concurrent replaces of the same client's list run one after the other
+        with transaction.atomic():
+            client=Client.objects.select_for_update().get(slug=self.request.GET.get('client'))
+
+            serializer = ContactPersonSerializer(
+                list(client.contactperson_set.select_for_update()), data=request.data['contact_person'], many=True
+            )
+
+            if serializer.is_valid():
+                serializer.save(client=client)
+                return Response(serializer.data)
+
+        return Response(serializer.errors,status=status.HTTP_400_BAD_REQUEST)
+
+class ClientCommentCursorPagination(CursorPagination):
+    """Keyset pagination of a client's comments, newest first
+    """
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    ordering = ('-created', '-id')
+
+
 class ClientCommentViewSet(viewsets.ModelViewSet):
     serializer_class = ClientCommentSerializer
     queryset = ClientComment.objects.order_by('-created')
@@ -172,8 +224,77 @@ class ClientCommentViewSet(viewsets.ModelViewSet):
         serializer=ClientCommentListSerializer(data=request.data)
         if serializer.is_valid():
             client=serializer.validated_data.get('client')
-            client_comments=ClientComment.objects.filter(client=client).order_by('-created')
-            serializer = self.get_serializer(client_comments, many=True)
+            client_comments=ClientComment.objects.filter(client=client).select_related('client', 'created_by')
+
+            # cursor pages are opt in with ?pagination=cursor
+            if request.query_params.get('pagination') == 'cursor':
+                paginator = ClientCommentCursorPagination()
+                page = paginator.paginate_queryset(client_comments, request, view=self)
+                serializer = self.get_serializer(page, many=True)
+
+                data = paginator.get_paginated_response(serializer.data).data
+                data['response'] = data.pop('results')
+
+                return Response(data)
+
+            serializer = self.get_serializer(client_comments.order_by('-created', '-id'), many=True)
             return Response(serializer.data)
         else:
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    def feed_item(self, comment):
+        data = self.get_serializer(comment).data
+        data['id'] = comment.id
+        return data
+
+    @action(methods=['post'], detail=False, url_path='comments-since')
+    def comments_since(self, request):
+        """comments of a client newer than after_id, oldest first, so a
+        loaded thread only fetches what was added since
+        """
+        serializer = ClientCommentFeedSerializer(data=request.data)
+
+        if serializer.is_valid():
+            after_id = serializer.validated_data['after_id']
+            comments = comment_feed.comments_since(serializer.validated_data['client'], after_id)
+
+            return Response({
+                'response': [self.feed_item(comment) for comment in comments],
+                'last_id': comments[-1].id if comments else after_id,
+                'has_more': len(comments) == comment_feed.FEED_PAGE_SIZE
+            })
+        else:
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    @action(methods=['get'], detail=False, url_path='comments-stream',
+        renderer_classes=[JSONRenderer, comment_feed.EventStreamRenderer])
+    def comments_stream(self, request):
+        """server sent events of new comments of ?client=, resuming after
+        ?after_id= or the Last-Event-ID header of a reconnecting browser,
+        disabled unless CLIENT_COMMENT_STREAM_ENABLED
+        """
+        if not comment_feed.STREAM_ENABLED:
+            data = {
+                'error': 'Comment stream is not enabled, use comments-since'
+            }
+            return Response(data, status=status.HTTP_404_NOT_FOUND)
+
+        data = {
+            'client': request.query_params.get('client'),
+            'after_id': request.META.get('HTTP_LAST_EVENT_ID') or request.query_params.get('after_id', 0)
+        }
+        serializer = ClientCommentFeedSerializer(data=data)
+
+        if serializer.is_valid():
+            events = comment_feed.comment_events(
+                serializer.validated_data['client'],
+                serializer.validated_data['after_id'],
+                self.feed_item
+            )
+
+            response = StreamingHttpResponse(events, content_type='text/event-stream')
+            response['Cache-Control'] = 'no-cache'
+            response['X-Accel-Buffering'] = 'no'
+            return response
+        else:
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -4,6 +4,6 @@ from django.apps import AppConfig
 class DepartmentsConfig(AppConfig):
     name = 'departments'
 
-    # def ready(self):
-    #      import departments.signals
+    def ready(self):
+        import departments.signals
 
@@ -0,0 +1,80 @@
+def requested_names(request, param):
+    """Returns the comma separated names of a query param as a set, None when
+    the param is absent so callers can fall back to their full output
+    """
+    if request is None:
+        return None
+
+    value = request.query_params.get(param)
+
+    if value is None:
+        return None
+
+    return {name.strip() for name in value.split(',') if name.strip()}
+
+
+def expanded_sections(request, sections):
+    """Returns the sections a SparseFieldsetMixin serializer builds for the
+    request, views pass them to the matching query plan
+    """
+    fields = requested_names(request, 'fields')
+    expand = requested_names(request, 'expand')
+
+    return {
+        name for name in sections
+        if (fields is None or name in fields) and (expand is None or name in expand)
+    }
+
+
+class SparseFieldsetMixin:
+    """Serializer mixin honouring the fields= and expand= query params of the
+    request in its context
+
+    fields= limits the output to the listed keys, expand= lists the nested
+    sections named in expandable_fields to build, every section is built when
+    expand= is absent
+    """
+    expandable_fields = ()
+
+    def _requested(self, param):
+        cache = getattr(self.root, '_requested_names', None)
+
+        if cache is None:
+            cache = self.root._requested_names = {}
+
+        if param not in cache:
+            cache[param] = requested_names(self.context.get('request'), param)
+
+        return cache[param]
+
+    def wants(self, name):
+        """whether key name is part of the requested output
+        """
+        fields = self._requested('fields')
+        return fields is None or name in fields
+
+    def should_expand(self, name):
+        """whether nested section name is built
+        """
+        expand = self._requested('expand')
+        return self.wants(name) and (expand is None or name in expand)
+
+    @property
+    def _readable_fields(self):
+        for field in super()._readable_fields:
+            if self.wants(field.field_name):
+                yield field
+
+    def sparse(self, data):
+        """drops keys added by to_representation that were not requested
+        """
+        fields = self._requested('fields')
+
+        if fields is None:
+            return data
+
+        for name in list(data):
+            if name not in fields:
+                del data[name]
+
+        return data
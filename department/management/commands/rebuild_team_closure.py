@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from departments.team_tree import rebuild_closure
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the team closure table from parent teams'
+
+    def handle(self, *args, **options):
+        rebuild_closure()
+
+        self.stdout.write(self.style.SUCCESS('Team closure rebuilt'))
@@ -11,6 +11,21 @@ def department_image_path(instance, filename):
     return 'departments/{0}/{1}'.format(instance.organization.organization_name, filename)
 
 
+class DepartmentQuerySet(models.QuerySet):
+
+    def for_serializer(self, fields=None):
+        """Query plan for DepartmentSerializer, when fields lists the requested
+        fields only their columns and joins are loaded
+        """
+        if fields is None:
+            return self.select_related('organization', 'branch')
+
+        related = [name for name in ('organization', 'branch') if name in fields]
+        columns = [name for name in ('slug', 'department_name', 'description') if name in fields]
+
+        return self.select_related(*related).only('id', *related, *columns)
+
+
 class Department(Base):
     """
     department model associated with details of the department
@@ -21,6 +36,8 @@ class Department(Base):
     description = models.TextField(null=True, blank=True)
     image = models.ImageField(null=True, blank=True, upload_to=department_image_path)
 
+    objects = DepartmentQuerySet.as_manager()
+
     class Meta:
         unique_together = ("department_name", "organization", "branch")
         
@@ -44,14 +61,56 @@ class Designation(Base):
         return self.designation_name
 
 
+class TeamQuerySet(models.QuerySet):
+
+    def subtree(self, team, include_self=True):
+        """teams under team at any depth
+        """
+        teams = self.filter(ancestor_links__ancestor=team)
+
+        if not include_self:
+            teams = teams.filter(ancestor_links__depth__gt=0)
+
+        return teams
+
+    def ancestors(self, team, include_self=False):
+        """teams above team, closest first
+        """
+        teams = self.filter(descendant_links__descendant=team)
+
+        if not include_self:
+            teams = teams.filter(descendant_links__depth__gt=0)
+
+        return teams.order_by('descendant_links__depth')
+
+
 class Team(Base):
     """
     team model associated with team,parent team details of the respective departments
     """
     department = models.ForeignKey(Department, on_delete=models.PROTECT)
     team_name = models.CharField(max_length=128)
-    parent_team = models.ForeignKey("self", null=True, blank=True, limit_choices_to={'parent_team': None},
+    # teams nest to any depth, the hierarchy is kept in TeamClosure
+    parent_team = models.ForeignKey("self", null=True, blank=True,
                                     related_name='sub_teams', on_delete=models.PROTECT)
 
+    objects = TeamQuerySet.as_manager()
+
     def __str__(self):
         return self.team_name
+
+
+class TeamClosure(models.Model):
+    """
+    closure table of the team hierarchy, one row per ancestor and descendant
+    pair, every team is paired with itself at depth 0
+    """
+    ancestor = models.ForeignKey(Team, on_delete=models.CASCADE, related_name='descendant_links')
+    descendant = models.ForeignKey(Team, on_delete=models.CASCADE, related_name='ancestor_links')
+    depth = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = ("ancestor", "descendant")
+        indexes = [
+            models.Index(fields=['descendant', 'depth']),
+        ]
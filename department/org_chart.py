@@ -0,0 +1,121 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Q
+
+from organizations.models import Branch
+from departments.models import Department, Team
+from departments.team_tree import team_tree
+from employees.models import Employee
+
+
+CACHE_TTL = getattr(settings, 'ORGANIZATION_CHART_CACHE_TTL', 300)
+
+
+def cache_key(organization_id):
+    return 'organization-chart:%s' % organization_id
+
+
+def invalidate_organization_chart(organization_ids):
+    """Drops cached charts once the current transaction commits, so a chart
+    built concurrently from uncommitted data is not kept
+    """
+    keys = [cache_key(organization_id) for organization_id in set(organization_ids)]
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def empty_headcount():
+    return {'active': 0, 'inactive': 0, 'invited': 0}
+
+
+def add_headcount(total, headcount):
+    for key in total:
+        total[key] += headcount[key]
+
+
+def headcounts(organization):
+    """employee headcounts by status grouped by (branch, department) with a
+    single aggregate query
+    """
+    rows = Employee.objects.filter(
+        organization=organization
+    ).order_by().values('branch_id', 'department_id').annotate(
+        active=Count('id', filter=Q(invitation_accepted=True, user__is_active=True)),
+        inactive=Count('id', filter=Q(invitation_accepted=True, user__is_active=False)),
+        invited=Count('id', filter=Q(invitation_accepted=False)),
+    )
+
+    return {
+        (row['branch_id'], row['department_id']): {
+            'active': row['active'],
+            'inactive': row['inactive'],
+            'invited': row['invited'],
+        }
+        for row in rows
+    }
+
+
+def build_organization_chart(organization):
+    """organization -> branches -> departments -> teams with headcounts,
+    employees of the organization without a branch are listed under general
+    """
+    counts = headcounts(organization)
+
+    teams = {}
+    for team in Team.objects.filter(
+        department__organization=organization
+    ).order_by('team_name').only('id', 'slug', 'team_name', 'parent_team_id', 'department_id'):
+        teams.setdefault(team.department_id, []).append(team)
+
+    def branch_node(branch_id, **fields):
+        node = dict(fields, headcount=empty_headcount(), departments=[])
+        add_headcount(node['headcount'], counts.get((branch_id, None), empty_headcount()))
+        return node
+
+    branches = {
+        None: branch_node(None)
+    }
+    for branch in Branch.objects.filter(organization=organization).values('id', 'slug', 'branch_name'):
+        branches[branch['id']] = branch_node(branch['id'], slug=branch['slug'], branch_name=branch['branch_name'])
+
+    for department in Department.objects.filter(
+        organization=organization
+    ).order_by('department_name').values('id', 'slug', 'department_name', 'branch_id'):
+        headcount = counts.get((department['branch_id'], department['id']), empty_headcount())
+        branch = branches.get(department['branch_id'], branches[None])
+
+        branch['departments'].append({
+            'slug': department['slug'],
+            'department_name': department['department_name'],
+            'headcount': headcount,
+            'teams': team_tree(teams.get(department['id'], []))
+        })
+        add_headcount(branch['headcount'], headcount)
+
+    headcount = empty_headcount()
+    for branch in branches.values():
+        add_headcount(headcount, branch['headcount'])
+
+    general = branches.pop(None)
+
+    return {
+        'slug': organization.slug,
+        'organization_name': organization.organization_name,
+        'headcount': headcount,
+        'general': general,
+        'branches': list(branches.values()),
+    }
+
+
+def organization_chart(organization):
+    """cached organization chart, invalidated on employee, user, branch,
+    department and team writes
+    """
+    key = cache_key(organization.pk)
+
+    chart = cache.get(key)
+    if chart is None:
+        chart = build_organization_chart(organization)
+        cache.set(key, chart, CACHE_TTL)
+
+    return chart
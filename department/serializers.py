@@ -1,15 +1,19 @@
 import uuid
+from django.db import transaction
+from django.utils import timezone
 from django.utils.text import slugify
 
 from rest_framework import serializers
 from rest_framework.validators import UniqueTogetherValidator
 
-from departments.models import Department, Designation
+from departments.models import Department, Designation, Team
 from organizations.models import Organization, Branch
 from general.models import PermissionGroup
+from departments.fieldsets import SparseFieldsetMixin
+from departments.org_chart import invalidate_organization_chart
 
 
-class DepartmentSerializer(serializers.ModelSerializer):
+class DepartmentSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
 	"""serializer to create, update, retrive , delete department of 
 	an organization or branch
 	"""
@@ -126,9 +130,11 @@ class DesignationSerializer(serializers.ModelSerializer):
 	def to_representation(self, obj):
 		data = super().to_representation(obj)
 
-		permission_groups = obj.permission_groups.all().values('slug' , 'group_name')
-
-		data['permission_groups'] = permission_groups
+		# iterating .all() keeps prefetched permission groups from being re-queried
+		data['permission_groups'] = [
+			{'slug': group.slug, 'group_name': group.group_name}
+			for group in obj.permission_groups.all()
+		]
 
 		return data
 
@@ -171,3 +177,90 @@ class DesignationListSerializer(serializers.ModelSerializer):
 	class Meta:
 		model = Designation
 		fields = ['organization']
+
+
+class DesignationReorderSerializer(serializers.Serializer):
+	"""serializer to validate a new ordering of an organization's designations
+	"""
+	organization = serializers.SlugRelatedField(queryset=Organization.objects.all(), slug_field='slug')
+	sort = serializers.ListField(child=serializers.CharField(), allow_empty=False)
+	previous = serializers.ListField(child=serializers.CharField(), required=False)
+
+
+class TeamSerializer(serializers.ModelSerializer):
+	"""create, update, retrive, delete teams of a department
+	"""
+	department = serializers.SlugRelatedField(queryset=Department.objects.all(), slug_field='slug')
+	parent_team = serializers.SlugRelatedField(queryset=Team.objects.all(), slug_field='slug', allow_null=True, required=False)
+
+	class Meta:
+		model = Team
+		fields = ['slug', 'department', 'team_name', 'parent_team']
+		read_only_fields = ['slug']
+
+	def validate(self, data):
+		"""validate parent team is of the same department and is not
+		the team itself or one of its sub teams
+		"""
+		department = data.get('department', getattr(self.instance, 'department', None))
+		parent_team = data.get('parent_team', getattr(self.instance, 'parent_team', None))
+
+		if parent_team:
+			if parent_team.department_id != department.pk:
+				raise serializers.ValidationError({
+					'parent_team': 'invalid parent team for department %s' %department.slug
+				})
+
+			if self.instance and Team.objects.subtree(self.instance).filter(pk=parent_team.pk).exists():
+				raise serializers.ValidationError({
+					'parent_team': 'a team can not be moved under itself or its sub teams'
+				})
+
+		return data
+
+	def create(self, validated_data):
+
+		user = self.context['request'].user
+
+		team = Team(**validated_data)
+		team.created_by = user
+		team.updated_by = user
+		team.slug = slugify(uuid.uuid4())
+		team.save()
+
+		return team
+
+	def update(self, instance, validated_data):
+
+		user = self.context['request'].user
+		department_id = instance.department_id
+
+		with transaction.atomic():
+			validated_data['updated_by'] = user
+			instance = super().update(instance, validated_data)
+
+			# sub teams move to the new department with their parent
+			if instance.department_id != department_id:
+				Team.objects.subtree(instance, include_self=False).update(
+					department_id=instance.department_id,
+					updated=timezone.now(),
+					updated_by=user
+				)
+
+				invalidate_organization_chart(Department.objects.filter(
+					pk__in=[department_id, instance.department_id]
+				).values_list('organization_id', flat=True))
+
+		return instance
+
+
+class TeamTreeSerializer(serializers.Serializer):
+	"""serializer to validate department of a team tree
+	"""
+	department = serializers.SlugRelatedField(queryset=Department.objects.all(), slug_field='slug')
+
+
+class OrganizationChartSerializer(serializers.Serializer):
+	"""serializer to validate organization of an organization chart
+	"""
+	organization = serializers.SlugRelatedField(queryset=Organization.objects.all(), slug_field='slug')
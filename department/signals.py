@@ -0,0 +1,66 @@
+from django.db.models.signals import post_init, post_save, post_delete
+from django.dispatch import receiver
+
+from accounts.models import User
+from organizations.models import Branch
+from employees.models import Employee
+from departments.models import Department, Team
+from departments.team_tree import insert_team, move_team
+from departments.org_chart import invalidate_organization_chart
+
+
+@receiver(post_init, sender=Team)
+def remember_parent_team(sender, instance, **kwargs):
+    instance._loaded_parent_team_id = instance.parent_team_id
+
+
+@receiver(post_save, sender=Team)
+def update_team_closure(sender, instance, created=False, raw=False, **kwargs):
+    if raw:
+        return
+
+    if created:
+        insert_team(instance)
+
+    elif instance.parent_team_id != instance._loaded_parent_team_id:
+        move_team(instance)
+
+    instance._loaded_parent_team_id = instance.parent_team_id
+
+
+@receiver(post_save, sender=Employee)
+@receiver(post_delete, sender=Employee)
+@receiver(post_save, sender=Department)
+@receiver(post_delete, sender=Department)
+@receiver(post_save, sender=Branch)
+@receiver(post_delete, sender=Branch)
+def invalidate_chart(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+
+    invalidate_organization_chart([instance.organization_id])
+
+
+@receiver(post_save, sender=Team)
+@receiver(post_delete, sender=Team)
+def invalidate_team_chart(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+
+    invalidate_organization_chart(
+        Department.objects.filter(pk=instance.department_id).values_list('organization_id', flat=True)
+    )
+
+
+@receiver(post_save, sender=User)
+def invalidate_user_chart(sender, instance, created=False, raw=False, update_fields=None, **kwargs):
+    # is_active moves employees between active and inactive headcounts
+    if raw or created:
+        return
+
+    if update_fields and 'is_active' not in update_fields:
+        return
+
+    invalidate_organization_chart(
+        Employee.objects.filter(user=instance).values_list('organization_id', flat=True)
+    )
@@ -0,0 +1,91 @@
+from django.db import transaction
+
+from departments.models import Team, TeamClosure
+
+
+def insert_team(team):
+    """links a new team to itself and to every ancestor of its parent
+    """
+    links = [TeamClosure(ancestor_id=team.pk, descendant_id=team.pk, depth=0)]
+
+    if team.parent_team_id:
+        for ancestor_id, depth in TeamClosure.objects.filter(
+            descendant_id=team.parent_team_id
+        ).values_list('ancestor_id', 'depth'):
+            links.append(TeamClosure(ancestor_id=ancestor_id, descendant_id=team.pk, depth=depth + 1))
+
+    TeamClosure.objects.bulk_create(links)
+
+
+def move_team(team):
+    """relinks the subtree of team under its new parent, only links crossing
+    the subtree boundary are rewritten
+    """
+    with transaction.atomic():
+        subtree = list(TeamClosure.objects.filter(
+            ancestor_id=team.pk
+        ).values_list('descendant_id', 'depth'))
+        subtree_ids = [descendant_id for descendant_id, depth in subtree]
+
+        TeamClosure.objects.filter(
+            descendant_id__in=subtree_ids
+        ).exclude(
+            ancestor_id__in=subtree_ids
+        ).delete()
+
+        if team.parent_team_id:
+            ancestors = TeamClosure.objects.filter(
+                descendant_id=team.parent_team_id
+            ).values_list('ancestor_id', 'depth')
+
+            TeamClosure.objects.bulk_create([
+                TeamClosure(
+                    ancestor_id=ancestor_id,
+                    descendant_id=descendant_id,
+                    depth=ancestor_depth + descendant_depth + 1
+                )
+                for ancestor_id, ancestor_depth in ancestors
+                for descendant_id, descendant_depth in subtree
+            ])
+
+
+def rebuild_closure():
+    """rebuilds the whole closure table from parent_team links
+    """
+    parents = dict(Team.objects.values_list('id', 'parent_team_id'))
+
+    links = []
+    for team_id in parents:
+        ancestor_id, depth = team_id, 0
+
+        while ancestor_id is not None and depth <= len(parents):
+            links.append(TeamClosure(ancestor_id=ancestor_id, descendant_id=team_id, depth=depth))
+            ancestor_id, depth = parents.get(ancestor_id), depth + 1
+
+    with transaction.atomic():
+        TeamClosure.objects.all().delete()
+        TeamClosure.objects.bulk_create(links, batch_size=1000)
+
+
+def team_tree(teams):
+    """nests teams fetched in one query under their parents, teams whose
+    parent is not in teams are roots
+    """
+    nodes = {}
+    for team in teams:
+        nodes[team.pk] = {
+            'slug': team.slug,
+            'team_name': team.team_name,
+            'sub_teams': []
+        }
+
+    roots = []
+    for team in teams:
+        parent = nodes.get(team.parent_team_id)
+
+        if parent is None:
+            roots.append(nodes[team.pk])
+        else:
+            parent['sub_teams'].append(nodes[team.pk])
+
+    return roots
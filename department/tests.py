@@ -0,0 +1,83 @@
+from django.test import TestCase
+
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from employees.tests import create_user, create_organization
+from departments.models import Department, Team
+from departments.serializers import TeamSerializer
+
+
+def create_department(organization, name='Engineering'):
+	owner = organization.created_by
+	return Department.objects.create(
+		organization=organization, department_name=name, created_by=owner, updated_by=owner
+	)
+
+
+def create_team(department, name, parent_team=None):
+	owner = department.created_by
+	return Team.objects.create(
+		department=department, team_name=name, parent_team=parent_team,
+		slug=name.lower(), created_by=owner, updated_by=owner
+	)
+
+
+class TeamSerializerTest(TestCase):
+
+	def setUp(self):
+		self.owner = create_user('owner@example.com', is_superuser=True)
+		organization = create_organization(self.owner)
+		self.department = create_department(organization)
+		self.other_department = create_department(organization, 'Sales')
+
+		self.root = create_team(self.department, 'Root')
+		self.child = create_team(self.department, 'Child', self.root)
+		self.grandchild = create_team(self.department, 'Grandchild', self.child)
+
+	def save(self, team, data):
+		request = Request(APIRequestFactory().patch('/'))
+		request.user = self.owner
+
+		serializer = TeamSerializer(team, data=data, partial=True, context={'request': request})
+		if serializer.is_valid():
+			serializer.save()
+
+		return serializer
+
+	def test_teams_nest_below_sub_teams(self):
+		leaf = create_team(self.department, 'Leaf')
+
+		serializer = self.save(leaf, {'parent_team': self.grandchild.slug})
+
+		self.assertFalse(serializer.errors)
+		self.assertEqual(
+			list(Team.objects.ancestors(leaf)),
+			[self.grandchild, self.child, self.root]
+		)
+
+	def test_parent_of_another_department_is_rejected(self):
+		other = create_team(self.other_department, 'Other')
+
+		serializer = self.save(other, {'parent_team': self.root.slug})
+
+		self.assertIn('parent_team', serializer.errors)
+
+	def test_department_change_keeping_parent_of_old_department_is_rejected(self):
+		serializer = self.save(self.child, {'department': self.other_department.slug})
+
+		self.assertIn('parent_team', serializer.errors)
+
+	def test_moving_under_own_sub_team_is_rejected(self):
+		serializer = self.save(self.root, {'parent_team': self.grandchild.slug})
+
+		self.assertIn('parent_team', serializer.errors)
+
+	def test_department_change_moves_sub_teams(self):
+		serializer = self.save(self.root, {'department': self.other_department.slug})
+
+		self.assertFalse(serializer.errors)
+		self.assertEqual(
+			set(Team.objects.subtree(self.root).values_list('department', flat=True)),
+			{self.other_department.pk}
+		)
@@ -9,5 +9,6 @@ router = DefaultRouter()
 router.register(r'departments', views.DepartmentViewSet, basename='department')
 router.register(r'designations', views.DesignationViewSet, basename='designation')
 router.register(r'search-departments', views.DepartmentSearchViewSet, basename='search_department')
+router.register(r'teams', views.TeamViewSet, basename='team')
 
 urlpatterns = router.urls
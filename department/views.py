@@ -1,15 +1,22 @@
+from django.db import transaction
+from django.db.models import Case, When, Value, F, PositiveIntegerField
+
 from rest_framework.views import APIView
 from rest_framework import viewsets
 from rest_framework.response import Response
 from rest_framework import status
-from rest_framework.authentication import TokenAuthentication
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.decorators import action
 
 from general.permissions import CustomModelPermissions, IsObjectUser, ListOrCreatePermission
-from .models import Department, Designation
+from employees.authentication import CachedTokenAuthentication
+from .models import Department, Designation, Team
+from .team_tree import team_tree
+from . import org_chart
+from .fieldsets import requested_names
 from .serializers import DepartmentSerializer, DepartmentListSerializer, DesignationSerializer, \
-	DesignationListSerializer
+	DesignationListSerializer, DesignationReorderSerializer, TeamSerializer, TeamTreeSerializer, \
+	OrganizationChartSerializer
 
 
 class DepartmentViewSet(viewsets.ModelViewSet):
@@ -18,7 +25,7 @@ class DepartmentViewSet(viewsets.ModelViewSet):
 	"""
 	serializer_class = DepartmentSerializer
 	queryset = Department.objects.all()
-	authentication_classes = [TokenAuthentication]
+	authentication_classes = [CachedTokenAuthentication]
 	permission_classes = [IsAuthenticated, CustomModelPermissions, IsObjectUser, ListOrCreatePermission]
 	lookup_field = 'slug'
 
@@ -35,6 +42,7 @@ class DepartmentViewSet(viewsets.ModelViewSet):
 
 			departments = Department.objects.filter(organization__slug=organization_slug)
 
+			departments = departments.for_serializer(requested_names(request, 'fields'))
 			serializer = self.get_serializer(departments, many=True)
 
 			return Response(serializer.data)
@@ -62,19 +70,44 @@ class DepartmentViewSet(viewsets.ModelViewSet):
 					branch__isnull=True
 				)
 
+			departments = departments.for_serializer(requested_names(request, 'fields'))
 			serializer = self.get_serializer(departments, many=True)
 
 			return Response(serializer.data)
 		else:
 			return Response(serializer.errors)
 
+	@action(methods=['post'], detail=False, url_path='organization-chart')
+	def organization_chart(self, request):
+		"""organization, branches, departments and teams with employee
+		headcounts in one cached response
+		"""
+		serializer = OrganizationChartSerializer(data=request.data)
+
+		if serializer.is_valid():
+			return Response(org_chart.organization_chart(serializer.validated_data['organization']))
+		else:
+			return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+def update_designation_weights(organization, slugs):
+	"""sets weight of each designation of organization to its position in
+	slugs with a single UPDATE
+	"""
+	whens = [When(slug=slug, then=Value(index)) for index, slug in enumerate(slugs)]
+
+	return Designation.objects.filter(
+		organization=organization,
+		slug__in=slugs
+	).update(weight=Case(*whens, default=F('weight'), output_field=PositiveIntegerField()))
+
 
 class DesignationViewSet(viewsets.ModelViewSet):
 	"""create, update, delete, retirve designation of an organization
 	"""
 	serializer_class = DesignationSerializer
 	queryset = Designation.objects.all()
-	authentication_classes = [TokenAuthentication]
+	authentication_classes = [CachedTokenAuthentication]
 	permission_classes = [IsAuthenticated, CustomModelPermissions, 
 	IsObjectUser, ListOrCreatePermission]
 	lookup_field = 'slug'
@@ -94,13 +127,13 @@ class DesignationViewSet(viewsets.ModelViewSet):
 
 			designations = Designation.objects.filter(
 				organization__slug=organization_slug
-			).order_by('weight')
+			).order_by('weight', 'id')
 
 			sort_list = self.request.data.get('sort')
 
 			if sort_list:
-				for index, slug in enumerate(sort_list):
-					Designation.objects.filter(slug=slug).update(weight=index)
+				organization = serializer.validated_data.get('organization')
+				update_designation_weights(organization, sort_list)
 
 			serializer = self.get_serializer(designations, many=True)
 
@@ -109,13 +142,58 @@ class DesignationViewSet(viewsets.ModelViewSet):
 			return Response(serializer.errors)
 
 
+	@action(methods=['post'], detail=False, url_path='reorder-designations')
+	def reorder_designations(self, request):
+		"""apply a new ordering to every designation of an organization,
+		previous is the ordering the client saw, the request is rejected
+		with 409 when designations were reordered since
+		"""
+		serializer = DesignationReorderSerializer(data=request.data)
+
+		if serializer.is_valid():
+
+			organization = serializer.validated_data['organization']
+			sort_list = serializer.validated_data['sort']
+			previous = serializer.validated_data.get('previous')
+
+			with transaction.atomic():
+				current = list(Designation.objects.select_for_update().filter(
+					organization=organization
+				).order_by('weight', 'id').values_list('slug', flat=True))
+
+				if previous is not None and previous != current:
+					data = {
+						'error': 'Designations were reordered by another user',
+						'current': current
+					}
+					return Response(data, status=status.HTTP_409_CONFLICT)
+
+				if len(sort_list) != len(current) or set(sort_list) != set(current):
+					data = {
+						'sort': 'sort must list every designation of the organization once'
+					}
+					return Response(data, status=status.HTTP_400_BAD_REQUEST)
+
+				update_designation_weights(organization, sort_list)
+
+			designations = Designation.objects.filter(
+				organization=organization
+			).order_by('weight', 'id')
+
+			serializer = self.get_serializer(designations, many=True)
+
+			return Response(serializer.data)
+		else:
+			return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
 class DepartmentSearchViewSet(viewsets.ModelViewSet):
 	"""create, update, delete, retirve departments of an organization or
 	branch
 	"""
 	serializer_class = DepartmentSerializer
 	queryset = Department.objects.all()
-	authentication_classes = [TokenAuthentication]
+	authentication_classes = [CachedTokenAuthentication]
 	permission_classes = [IsAuthenticated, CustomModelPermissions, IsObjectUser, ListOrCreatePermission]
 	lookup_field = 'slug'
 
@@ -148,6 +226,7 @@ class DepartmentSearchViewSet(viewsets.ModelViewSet):
 			if search:
 				departments = departments.filter(department_name__icontains=search)
 
+			departments = departments.for_serializer(requested_names(request, 'fields'))
 			serializer = self.get_serializer(departments, many=True)
 
 			return Response(serializer.data)
@@ -155,3 +234,54 @@ class DepartmentSearchViewSet(viewsets.ModelViewSet):
 			return Response(serializer.errors)
 
 
+class TeamViewSet(viewsets.ModelViewSet):
+	"""create, update, delete, retirve teams of a department and query
+	the team hierarchy through its closure table
+	"""
+	serializer_class = TeamSerializer
+	queryset = Team.objects.all()
+	authentication_classes = [CachedTokenAuthentication]
+	permission_classes = [IsAuthenticated, CustomModelPermissions, IsObjectUser, ListOrCreatePermission]
+	lookup_field = 'slug'
+
+	def list(self, request):
+		data = {'detail': 'Not found'}
+		return Response(data, status=status.HTTP_404_NOT_FOUND)
+
+	@action(methods=['post'], detail=False, url_path='department-teams')
+	def department_teams(self, request):
+		"""whole team tree of a department with one query
+		"""
+		serializer = TeamTreeSerializer(data=request.data)
+
+		if serializer.is_valid():
+
+			teams = Team.objects.filter(
+				department=serializer.validated_data['department']
+			).order_by('team_name').only('id', 'slug', 'team_name', 'parent_team_id')
+
+			return Response(team_tree(list(teams)))
+		else:
+			return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+	@action(methods=['get'], detail=True, url_path='subtree')
+	def subtree(self, request, slug=None):
+		"""team and all teams under it, nested
+		"""
+		team = self.get_object()
+
+		teams = Team.objects.subtree(team).order_by('team_name').only(
+			'id', 'slug', 'team_name', 'parent_team_id'
+		)
+
+		return Response(team_tree(list(teams)))
+
+	@action(methods=['get'], detail=True, url_path='ancestors')
+	def ancestors(self, request, slug=None):
+		"""teams above a team, closest first
+		"""
+		team = self.get_object()
+
+		teams = Team.objects.ancestors(team).values('slug', 'team_name')
+
+		return Response(list(teams))
@@ -0,0 +1,206 @@
+import time
+import pickle
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.translation import gettext_lazy as _
+
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from .cache_stamps import get_stamp, bump_stamps
+
+
+CACHE_SIZE = getattr(settings, 'TOKEN_AUTH_CACHE_SIZE', 10000)
+CACHE_TTL = getattr(settings, 'TOKEN_AUTH_CACHE_TTL', 60)
+
+# alias of a cache shared between processes holding tokens and revocation
+# stamps, tokens are not cached at all without one
+SHARED_CACHE = getattr(settings, 'TOKEN_AUTH_SHARED_CACHE', None)
+
+# backends whose entries other processes never see, revocations published
+# through them would not reach the other processes' copies
+PROCESS_LOCAL_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def shared_cache_enabled():
+    if SHARED_CACHE is None:
+        return False
+
+    backend = settings.CACHES.get(SHARED_CACHE, {}).get('BACKEND')
+
+    if backend is None or backend in PROCESS_LOCAL_BACKENDS:
+        raise ImproperlyConfigured(
+            'TOKEN_AUTH_SHARED_CACHE must name a cache shared between processes, got %r' % SHARED_CACHE
+        )
+
+    return True
+
+
+CACHE_ENABLED = shared_cache_enabled()
+
+
+class TokenCache:
+    """Thread safe LRU of pickled tokens expiring after ttl seconds
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+
+            if entry is None or entry[1] < time.monotonic():
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+
+        return pickle.loads(entry[0])
+
+    def set(self, key, token):
+        data = pickle.dumps(token)
+
+        with self.lock:
+            self.entries[key] = (data, time.monotonic() + self.ttl)
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'size': len(self.entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+token_cache = TokenCache(CACHE_SIZE, CACHE_TTL)
+
+
+def shared_cache_key(key):
+    return 'auth-token:%s' % key
+
+
+def revocation_key(user_id):
+    return 'auth-token-revocation:%s' % user_id
+
+
+def revocation_stamp(user_id):
+    return get_stamp(revocation_key(user_id), using=SHARED_CACHE)
+
+
+def drop_tokens(keys, user_ids):
+    if not CACHE_ENABLED:
+        return
+
+    for key in keys:
+        token_cache.delete(key)
+
+    if keys:
+        caches[SHARED_CACHE].delete_many([shared_cache_key(key) for key in keys])
+
+    # copies held by other processes are refused on their next use
+    bump_stamps([revocation_key(user_id) for user_id in user_ids], using=SHARED_CACHE)
+
+
+def invalidate_tokens(keys, user_ids):
+    """Removes tokens of the given users from the process and shared caches
+    and revokes the users' copies in other processes, once the current
+    transaction commits so a request racing the change cannot cache the old
+    state again
+    """
+    keys = list(keys)
+    user_ids = set(user_ids)
+    transaction.on_commit(lambda: drop_tokens(keys, user_ids))
+
+
+def invalidate_user_tokens(user_ids):
+    """Removes cached tokens of the given users
+    """
+    user_ids = list(user_ids)
+    invalidate_tokens(Token.objects.filter(user_id__in=user_ids).values_list('key', flat=True), user_ids)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """Token authentication reusing tokens resolved by previous requests
+
+    Tokens are cached in process and in the shared cache named by
+    TOKEN_AUTH_SHARED_CACHE, next to the revocation stamp of their user. A
+    cached token is only used while the stamp in the shared cache is
+    unchanged, so invalidation applies to every process on its next request.
+    Without a shared cache every request reads its token from the database
+    """
+
+    def cached_token(self, key):
+        entry = token_cache.get(key)
+
+        if entry is None:
+            entry = caches[SHARED_CACHE].get(shared_cache_key(key))
+
+            if entry is not None:
+                token_cache.set(key, entry)
+
+        if entry is None:
+            return None
+
+        token, stamp = entry
+
+        if stamp != revocation_stamp(token.user_id):
+            token_cache.delete(key)
+            return None
+
+        return token
+
+    def authenticate_credentials(self, key):
+        if not CACHE_ENABLED:
+            return super().authenticate_credentials(key)
+
+        token = self.cached_token(key)
+
+        if token is None:
+            model = self.get_model()
+
+            try:
+                token = model.objects.select_related('user').get(key=key)
+            except model.DoesNotExist:
+                raise exceptions.AuthenticationFailed(_('Invalid token.'))
+
+            entry = (token, revocation_stamp(token.user_id))
+            token_cache.set(key, entry)
+            caches[SHARED_CACHE].set(shared_cache_key(key), entry, CACHE_TTL)
+
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+
+        return (token.user, token)
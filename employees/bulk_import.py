@@ -0,0 +1,302 @@
+import io
+import csv
+import json
+import uuid
+
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import transaction, IntegrityError
+from django.db.models.functions import Lower
+from django.utils.text import slugify
+
+from phonenumber_field.phonenumber import to_python as to_phone_number
+
+from departments.models import Department, Designation
+from organizations.models import Branch
+from accounts.models import User
+from .models import Employee, OutboxEmail
+from .search import index_employees
+from .geo import geo_index, postcode_valid
+from .effective_permissions import rebuild_permission_sets
+from departments.org_chart import invalidate_organization_chart
+
+
+IMPORT_FIELDS = [
+    'email', 'first_name', 'last_name', 'phone', 'nationality', 'state', 'city',
+    'branch', 'department', 'designation', 'house_name', 'street_name',
+    'locality_name', 'pin_code'
+]
+
+REQUIRED_FIELDS = ['email', 'first_name', 'last_name', 'nationality', 'designation']
+
+ADDRESS_FIELDS = ['house_name', 'street_name', 'locality_name', 'pin_code']
+
+
+def read_rows(file, file_name):
+    """Returns rows of a csv or jsonl file as dictionaries
+    """
+    text = io.TextIOWrapper(file, encoding='utf-8-sig')
+
+    if file_name.lower().endswith('.jsonl'):
+        return [json.loads(line) for line in text if line.strip()]
+
+    return list(csv.DictReader(text))
+
+
+def clean_value(value):
+    if value is None:
+        return ''
+
+    return str(value).strip()
+
+
+def to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class EmployeeImporter:
+    """Validates and creates a batch of employees of an organization, every
+    related object of the batch is looked up with one query per model and
+    addresses are checked against the geo index
+    """
+
+    def __init__(self, organization, created_by, invite_serializer=None):
+        self.organization = organization
+        self.created_by = created_by
+        self.invite_serializer = invite_serializer
+
+    def load_lookups(self, rows):
+        """set based lookups of every value referenced by the batch
+        """
+        def values(field):
+            return {row[field] for row in rows if row.get(field)}
+
+        self.branches = dict(Branch.objects.filter(
+            organization=self.organization, slug__in=values('branch')
+        ).values_list('slug', 'id'))
+        self.departments = {
+            slug: (pk, branch_id) for slug, pk, branch_id in Department.objects.filter(
+                organization=self.organization, slug__in=values('department')
+            ).values_list('slug', 'id', 'branch_id')
+        }
+        self.designations = dict(Designation.objects.filter(
+            organization=self.organization, slug__in=values('designation')
+        ).values_list('slug', 'id'))
+
+        # emails are unique regardless of case
+        self.existing_emails = set(User.objects.annotate(
+            email_lower=Lower('email')
+        ).filter(
+            email_lower__in={email.lower() for email in values('email')}
+        ).values_list('email_lower', flat=True))
+
+    def validate_row(self, row, seen_emails):
+        """returns employee field values of a row and its errors
+        """
+        errors = {}
+
+        for field in REQUIRED_FIELDS:
+            if not row.get(field):
+                errors[field] = ['This field is required.']
+
+        # stored like the single create path, compared without case
+        email = User.objects.normalize_email(row.get('email', ''))
+        if email:
+            try:
+                validate_email(email)
+            except ValidationError:
+                errors['email'] = ['Enter a valid email address.']
+            else:
+                if email.lower() in self.existing_emails or email.lower() in seen_emails:
+                    errors['email'] = ['user with this email address already exists.']
+
+        nationality_id = to_int(row.get('nationality'))
+        country_code = geo_index.country_code(nationality_id)
+        if row.get('nationality') and country_code is None:
+            errors['nationality'] = ['Invalid country']
+
+        state_id = to_int(row.get('state'))
+        if row.get('state') and not geo_index.state_in_country(state_id, nationality_id):
+            errors['state'] = ['invalid state for Nationality %s' % row.get('nationality')]
+
+        city_id = to_int(row.get('city'))
+        if row.get('city') and not geo_index.city_in_state(city_id, state_id):
+            errors['city'] = ['invalid city for state %s' % row.get('state')]
+
+        pin_code = row.get('pin_code')
+        if pin_code and country_code and not postcode_valid(pin_code, country_code):
+            errors['pin_code'] = ['Invalid pincode']
+
+        phone = None
+        if row.get('phone'):
+            phone = to_phone_number(row['phone'])
+            if not (phone and phone.is_valid()):
+                errors['phone'] = ['Enter a valid phone number.']
+
+        branch_id = None
+        if row.get('branch'):
+            branch_id = self.branches.get(row['branch'])
+            if branch_id is None:
+                errors['branch'] = ['Invalid Branch for Organiation %s' % self.organization.slug]
+
+        department_id = None
+        if row.get('department'):
+            department_id, department_branch_id = self.departments.get(row['department'], (None, None))
+            if department_id is None or department_branch_id != branch_id:
+                errors['department'] = ['Invalid Department for Organiation and Branch']
+
+        designation_id = self.designations.get(row.get('designation'))
+        if row.get('designation') and designation_id is None:
+            errors['designation'] = ['Invalid Designation for Organiation %s' % self.organization.slug]
+
+        if errors:
+            return None, errors
+
+        values = {
+            'email': email,
+            'first_name': row['first_name'],
+            'last_name': row['last_name'],
+            'phone': str(phone) if phone else None,
+            'nationality_id': nationality_id,
+            'state_id': state_id,
+            'city_id': city_id,
+            'branch_id': branch_id,
+            'department_id': department_id,
+            'designation_id': designation_id,
+        }
+
+        for field in ADDRESS_FIELDS:
+            values[field] = row.get(field) or None
+
+        return values, errors
+
+    def validate(self, rows):
+        """returns valid rows and a per row error report, rows are numbered
+        from 1
+        """
+        rows = [
+            {field: clean_value(row.get(field)) for field in IMPORT_FIELDS} if isinstance(row, dict) else None
+            for row in rows
+        ]
+
+        self.load_lookups([row for row in rows if row is not None])
+
+        valid_rows = []
+        report = []
+        seen_emails = set()
+
+        for number, row in enumerate(rows, start=1):
+            if row is None:
+                report.append({'row': number, 'errors': {'non_field_errors': ['Expected an object.']}})
+                continue
+
+            values, errors = self.validate_row(row, seen_emails)
+
+            if errors:
+                report.append({'row': number, 'errors': errors})
+            else:
+                seen_emails.add(values['email'].lower())
+                valid_rows.append(values)
+
+        return valid_rows, report
+
+    def create(self, valid_rows):
+        """creates users, employees, their permission groups and invitation
+        emails with bulk inserts
+        """
+        with transaction.atomic():
+            users = []
+            for values in valid_rows:
+                user = User(email=values['email'], is_active=False)
+                user.set_unusable_password()
+                users.append(user)
+
+            User.objects.bulk_create(users)
+
+            # bulk_create only sets primary keys on some databases
+            user_ids = dict(User.objects.filter(
+                email__in=[user.email for user in users]
+            ).values_list('email', 'id'))
+
+            for user in users:
+                user.pk = user_ids[user.email]
+
+            employees = []
+            for user, values in zip(users, valid_rows):
+                values = dict(values)
+                values.pop('email')
+
+                employee = Employee(**values)
+                employee.user = user
+                employee.organization = self.organization
+                employee.created_by = self.created_by
+                employee.updated_by = self.created_by
+                employee.slug = slugify(uuid.uuid4())
+                employees.append(employee)
+
+            Employee.objects.bulk_create(employees)
+
+            employee_ids = dict(Employee.objects.filter(
+                slug__in=[employee.slug for employee in employees]
+            ).values_list('slug', 'id'))
+
+            for employee in employees:
+                employee.pk = employee_ids[employee.slug]
+
+            self.assign_permission_groups(employees)
+            rebuild_permission_sets(employee_ids.values())
+
+            index_employees(employee_ids.values())
+            invalidate_organization_chart([self.organization.pk])
+
+            if self.invite_serializer is not None:
+                OutboxEmail.objects.bulk_create([
+                    self.invite_serializer.invitation_email(employee) for employee in employees
+                ])
+
+        return employees
+
+    def assign_permission_groups(self, employees):
+        """copies permission groups of each designation to its employees
+        """
+        designation_groups = {}
+
+        for designation_id, group_id in Designation.permission_groups.through.objects.filter(
+            designation_id__in={employee.designation_id for employee in employees}
+        ).values_list('designation_id', 'permissiongroup_id'):
+            designation_groups.setdefault(designation_id, []).append(group_id)
+
+        EmployeePermissionGroup = Employee.permission_groups.through
+
+        EmployeePermissionGroup.objects.bulk_create([
+            EmployeePermissionGroup(employee_id=employee.pk, permissiongroup_id=group_id)
+            for employee in employees
+            for group_id in designation_groups.get(employee.designation_id, [])
+        ], batch_size=1000)
+
+    def run(self, rows, dry_run=False):
+        """validates rows and creates the valid ones unless dry_run,
+        returns a report of created and rejected rows
+        """
+        valid_rows, report = self.validate(rows)
+
+        created = []
+        if valid_rows and not dry_run:
+            try:
+                created = self.create(valid_rows)
+            except IntegrityError:
+                # users created by another request since validation are
+                # reported and the rest of the batch is created again
+                valid_rows, report = self.validate(rows)
+
+                if valid_rows:
+                    created = self.create(valid_rows)
+
+        return {
+            'valid': len(valid_rows),
+            'created': [employee.slug for employee in created],
+            'errors': report
+        }
@@ -0,0 +1,24 @@
+import uuid
+
+from django.core.cache import caches
+
+
+def get_stamp(key, using='default'):
+    """Returns the version stamp stored at key, every process agrees on the
+    stamp created by the first reader
+    """
+    cache = caches[using]
+    stamp = cache.get(key)
+
+    if stamp is None:
+        stamp = uuid.uuid4().hex
+        cache.add(key, stamp, None)
+        stamp = cache.get(key, stamp)
+
+    return stamp
+
+
+def bump_stamps(keys, using='default'):
+    """Moves the given keys to new version stamps
+    """
+    caches[using].set_many({key: uuid.uuid4().hex for key in keys}, None)
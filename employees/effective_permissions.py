@@ -0,0 +1,87 @@
+from django.db import transaction
+
+from .models import Employee, EmployeePermissionSet
+from .permission_cache import invalidate_permission_decisions
+
+
+EmployeePermissionGroup = Employee.permission_groups.through
+
+
+def build_bitset(permission_ids):
+    """Returns bytes with bit n set for every permission id n
+    """
+    if not permission_ids:
+        return b''
+
+    bitset = bytearray((max(permission_ids) >> 3) + 1)
+    for permission_id in permission_ids:
+        bitset[permission_id >> 3] |= 1 << (permission_id & 7)
+
+    return bytes(bitset)
+
+
+def rebuild_permission_sets(employee_ids):
+    """Rebuilds effective permissions of the given employees with one query
+    over their groups' permissions
+    """
+    employee_ids = set(employee_ids)
+    if not employee_ids:
+        return
+
+    with transaction.atomic():
+        # concurrent rebuilds of the same employees run one after the other,
+        # rows are locked in id order so overlapping batches do not deadlock
+        organization_ids = dict(Employee.objects.select_for_update().filter(
+            id__in=employee_ids
+        ).order_by('id').values_list('id', 'organization_id'))
+
+        # employees deleted in the meantime have no set to rebuild
+        employee_ids = set(organization_ids)
+
+        permissions = {employee_id: {} for employee_id in employee_ids}
+
+        for employee_id, permission_id, codename in EmployeePermissionGroup.objects.filter(
+            employee_id__in=employee_ids,
+            permissiongroup__permissions__isnull=False
+        ).values_list(
+            'employee_id', 'permissiongroup__permissions__id', 'permissiongroup__permissions__codename'
+        ):
+            permissions[employee_id][permission_id] = codename
+
+        versions = dict(EmployeePermissionSet.objects.filter(
+            employee_id__in=employee_ids
+        ).values_list('employee_id', 'version'))
+
+        EmployeePermissionSet.objects.filter(employee_id__in=employee_ids).delete()
+        EmployeePermissionSet.objects.bulk_create([
+            EmployeePermissionSet(
+                employee_id=employee_id,
+                codenames=' '.join(sorted(set(granted.values()))),
+                bitset=build_bitset(granted.keys()),
+                version=versions.get(employee_id, 0) + 1
+            )
+            for employee_id, granted in permissions.items()
+        ])
+
+        invalidate_permission_decisions(organization_ids.values())
+
+
+def rebuild_group_permission_sets(group_ids):
+    """Rebuilds effective permissions of every employee in the given groups
+    """
+    rebuild_permission_sets(EmployeePermissionGroup.objects.filter(
+        permissiongroup_id__in=group_ids
+    ).values_list('employee_id', flat=True).distinct())
+
+
+def get_permission_set(employee):
+    """Returns the effective permissions of an employee, building them when
+    missing
+    """
+    try:
+        return employee.permission_set
+    except EmployeePermissionSet.DoesNotExist:
+        rebuild_permission_sets([employee.pk])
+
+        employee.permission_set = EmployeePermissionSet.objects.get(employee_id=employee.pk)
+        return employee.permission_set
@@ -0,0 +1,132 @@
+import time
+import threading
+from array import array
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import transaction
+
+from general.models import Country, State, City
+from general.validators import is_postcode_valid
+from .cache_stamps import get_stamp, bump_stamps
+
+
+VERSION_CACHE_KEY = 'geo-index-version'
+
+# seconds between checks of the shared version stamp
+CHECK_INTERVAL = getattr(settings, 'GEO_INDEX_CHECK_INTERVAL', 30)
+
+
+class ParentTable:
+    """Maps child ids to parent ids, stored as a flat array indexed by id when
+    ids are dense enough and as a dict otherwise, -1 marks ids without a row
+    and 0 rows without a parent
+    """
+
+    def __init__(self, pairs):
+        pairs = list(pairs)
+        max_id = max((child_id for child_id, parent_id in pairs), default=0)
+
+        if max_id <= 4 * len(pairs) + 1024:
+            self.parents = array('l', [-1]) * (max_id + 1)
+            for child_id, parent_id in pairs:
+                self.parents[child_id] = parent_id or 0
+        else:
+            self.parents = {child_id: parent_id or 0 for child_id, parent_id in pairs}
+
+    def lookup(self, child_id):
+        if child_id is None or child_id < 0:
+            return -1
+
+        try:
+            return self.parents[child_id]
+        except (IndexError, KeyError, TypeError):
+            return -1
+
+    def contains(self, child_id):
+        return self.lookup(child_id) != -1
+
+    def get(self, child_id):
+        parent_id = self.lookup(child_id)
+        return parent_id if parent_id > 0 else None
+
+
+class GeoIndex:
+    """Lazily loaded country -> state -> city membership index shared by
+    address validation, reloaded when the version stamp in the cache changes
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None
+        self.checked_at = 0
+        self.country_codes = None
+        self.state_countries = None
+        self.city_states = None
+
+    def load(self, version):
+        self.country_codes = dict(Country.objects.values_list('id', 'code2'))
+        self.state_countries = ParentTable(State.objects.values_list('id', 'country_id').iterator())
+        self.city_states = ParentTable(City.objects.values_list('id', 'region_id').iterator())
+        self.version = version
+
+    def ensure_loaded(self):
+        now = time.monotonic()
+
+        if self.version is not None and now - self.checked_at < CHECK_INTERVAL:
+            return
+
+        with self.lock:
+            if self.version is not None and now - self.checked_at < CHECK_INTERVAL:
+                return
+
+            version = get_stamp(VERSION_CACHE_KEY)
+
+            if version != self.version:
+                self.load(version)
+
+            self.checked_at = now
+
+    def reset(self):
+        with self.lock:
+            self.version = None
+
+    def country_code(self, country_id):
+        self.ensure_loaded()
+        return self.country_codes.get(country_id)
+
+    def state_in_country(self, state_id, country_id):
+        self.ensure_loaded()
+        # states without a country match a missing country
+        return self.state_countries.contains(state_id) and self.state_countries.get(state_id) == country_id
+
+    def city_in_state(self, city_id, state_id):
+        self.ensure_loaded()
+        # cities without a region are valid without a state
+        return self.city_states.contains(city_id) and self.city_states.get(city_id) == state_id
+
+
+geo_index = GeoIndex()
+
+
+def reload_geo_index():
+    bump_stamps([VERSION_CACHE_KEY])
+    geo_index.reset()
+
+
+def invalidate_geo_index():
+    """Publishes a new version stamp once the current transaction commits so
+    every process reloads its index
+    """
+    transaction.on_commit(reload_geo_index)
+
+
+@lru_cache(maxsize=4096)
+def _is_postcode_valid(pin_code, country_code):
+    return is_postcode_valid(pin_code, country_code)
+
+
+def postcode_valid(pin_code, country_code):
+    """Memoized is_postcode_valid, postcode formats never change at runtime
+    """
+    return _is_postcode_valid(pin_code, country_code)
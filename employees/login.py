@@ -0,0 +1,51 @@
+import hmac
+import hashlib
+
+from django.conf import settings
+from django.contrib.auth import authenticate
+from django.core.cache import cache
+
+
+# seconds a rejected email and password pair is refused without hashing
+FAILED_LOGIN_TTL = getattr(settings, 'FAILED_LOGIN_CACHE_TTL', 300)
+
+
+def generation_key(email):
+    return 'login-generation:%s' % email.lower()
+
+
+def failed_login_key(email, password):
+    """Cache key of a rejected pair, the password never leaves the process
+    in clear and the key changes with the email's password generation
+    """
+    generation = cache.get(generation_key(email), 0)
+    message = '%s\0%s\0%s' % (email.lower(), generation, password)
+    digest = hmac.new(settings.SECRET_KEY.encode(), message.encode(), hashlib.sha256).hexdigest()
+
+    return 'failed-login:%s' % digest
+
+
+def password_changed(email):
+    """Forgets rejected passwords of an email after its password changed
+    """
+    try:
+        cache.incr(generation_key(email))
+    except ValueError:
+        cache.set(generation_key(email), 1, None)
+
+
+def authenticate_remembered(email, password):
+    """authenticate() refusing pairs rejected within FAILED_LOGIN_TTL without
+    verifying a hash
+    """
+    key = failed_login_key(email, password)
+
+    if cache.get(key):
+        return None
+
+    user = authenticate(username=email, password=password)
+
+    if user is None:
+        cache.set(key, True, FAILED_LOGIN_TTL)
+
+    return user
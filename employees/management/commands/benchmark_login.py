@@ -0,0 +1,31 @@
+import time
+
+from django.contrib.auth import authenticate
+from django.contrib.auth.hashers import get_hasher
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = 'Measures logins per second of an existing account, the user lookup and password verification of a login'
+
+    def add_arguments(self, parser):
+        parser.add_argument('email')
+        parser.add_argument('password')
+        parser.add_argument('--logins', type=int, default=50)
+
+    def handle(self, *args, **options):
+        email = options['email']
+        password = options['password']
+        logins = options['logins']
+
+        # the first login may rehash the password with the configured hasher
+        if authenticate(username=email, password=password) is None:
+            raise CommandError('Unable to log in with the given email and password')
+
+        start = time.perf_counter()
+        for _ in range(logins):
+            authenticate(username=email, password=password)
+        elapsed = time.perf_counter() - start
+
+        self.stdout.write('hasher: %s' % get_hasher().algorithm)
+        self.stdout.write('logins/sec: %.1f' % (logins / elapsed))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from employees.models import EmployeeScreenshot
+from employees.screenshot_variants import process_screenshots
+
+
+class Command(BaseCommand):
+    help = 'Generates thumbnail and compact variants of screenshots missing them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+
+    def handle(self, *args, **options):
+        screenshot_ids = list(
+            EmployeeScreenshot.objects.filter(thumbnail='').order_by('id').values_list('id', flat=True)
+        )
+        batch_size = options['batch_size']
+
+        for start in range(0, len(screenshot_ids), batch_size):
+            process_screenshots(screenshot_ids[start:start + batch_size])
+
+        self.stdout.write(self.style.SUCCESS('Processed %d screenshots' % len(screenshot_ids)))
@@ -0,0 +1,45 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.models import User
+from organizations.models import Organization
+from employees.bulk_import import EmployeeImporter, read_rows
+from employees.serializers import InviteEmployeeSerializer
+
+
+class Command(BaseCommand):
+    help = 'Imports employees of an organization from a csv or jsonl file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='csv or jsonl file of employees')
+        parser.add_argument('--organization', required=True, help='slug of the organization')
+        parser.add_argument('--created-by', required=True, help='email of the user importing employees')
+        parser.add_argument('--invite-url', help='url used in invitation emails, no emails are sent without it')
+        parser.add_argument('--site-name', default='')
+        parser.add_argument('--dry-run', action='store_true', help='only validate the file')
+
+    def handle(self, *args, **options):
+        try:
+            organization = Organization.objects.get(slug=options['organization'])
+            created_by = User.objects.get(email=options['created_by'])
+        except (Organization.DoesNotExist, User.DoesNotExist) as e:
+            raise CommandError(e)
+
+        invite_serializer = None
+        if options['invite_url']:
+            invite_serializer = InviteEmployeeSerializer(data={
+                'invite_url': options['invite_url'],
+                'site_name': options['site_name'] or options['invite_url']
+            })
+
+            if not invite_serializer.is_valid():
+                raise CommandError(invite_serializer.errors)
+
+        with open(options['path'], 'rb') as file:
+            rows = read_rows(file, options['path'])
+
+        importer = EmployeeImporter(organization, created_by, invite_serializer)
+        report = importer.run(rows, dry_run=options['dry_run'])
+
+        self.stdout.write(json.dumps(report, indent=2))
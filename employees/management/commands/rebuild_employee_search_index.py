@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from employees.models import Employee
+from employees.search import index_employees
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the employee search index'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--organization', help='slug of the organization to reindex')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        employees = Employee.objects.order_by('id')
+
+        if options['organization']:
+            employees = employees.filter(organization__slug=options['organization'])
+
+        employee_ids = list(employees.values_list('id', flat=True))
+        batch_size = options['batch_size']
+
+        for start in range(0, len(employee_ids), batch_size):
+            index_employees(employee_ids[start:start + batch_size])
+
+        self.stdout.write(self.style.SUCCESS('Indexed %d employees' % len(employee_ids)))
@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from employees.outbox import send_pending_emails
+
+
+class Command(BaseCommand):
+    help = 'Sends pending emails of the outbox'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--loop', action='store_true', help='keep polling the outbox')
+        parser.add_argument('--interval', type=float, default=5, help='seconds between polls when idle')
+
+    def handle(self, *args, **options):
+        while True:
+            try:
+                sent = send_pending_emails(batch_size=options['batch_size'])
+            except Exception as e:
+                if not options['loop']:
+                    raise
+
+                # a database outage must not stop the polling loop
+                self.stderr.write('Unable to send outbox emails: %s' % e)
+                sent = 0
+
+            if sent:
+                self.stdout.write('Sent %d emails' % sent)
+
+            if not options['loop']:
+                break
+
+            if not sent:
+                time.sleep(options['interval'])
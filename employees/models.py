@@ -1,5 +1,7 @@
 from django.db import models
+from django.db.models import Prefetch
 from django.utils import timezone
+from django.utils.functional import cached_property
 
 from django.utils.translation import gettext_lazy as _
 
@@ -7,6 +9,55 @@ from general.models import Base, Country, State, City, PermissionGroup
 from accounts.models import User
 from organizations.models import Organization,Branch
 from departments.models import Designation
+from .storage import screenshot_storage
+
+
+# columns read by EmployeeSerializer.to_representation; related models not
+# listed here (designation, branch, department, organization) are loaded in
+# full because their nested serializers read most of their fields
+EMPLOYEE_SERIALIZER_FIELDS = (
+    'id', 'slug', 'user', 'organization', 'branch', 'department', 'designation',
+    'photo', 'first_name', 'last_name', 'phone', 'nationality', 'state', 'city',
+    'house_name', 'street_name', 'locality_name', 'pin_code', 'invitation_accepted',
+    'user__email', 'user__is_active', 'user__is_superuser',
+    'nationality__name_ascii', 'state__name_ascii', 'city__name_ascii',
+)
+
+
+class EmployeeQuerySet(models.QuerySet):
+
+    def for_serializer(self, expand=None):
+        """Query plan for serializing employees with EmployeeSerializer,
+        a page costs the same number of queries whatever its size
+
+        expand lists the nested sections built by the serializer, sections
+        left out only join the table their slug is read from
+        """
+        related = ['user', 'organization', 'nationality', 'state', 'city']
+        prefetches = []
+
+        if expand is None or 'designation' in expand:
+            related.append('designation__organization')
+            prefetches.append(Prefetch(
+                'designation__permission_groups',
+                queryset=PermissionGroup.objects.only('id', 'slug', 'group_name')
+            ))
+        else:
+            related.append('designation')
+
+        if expand is None or 'branch' in expand:
+            related.append('branch__organization')
+        else:
+            related.append('branch')
+
+        if expand is None or 'department' in expand:
+            related.extend(['department__organization', 'department__branch'])
+        else:
+            related.append('department')
+
+        return self.select_related(*related).prefetch_related(
+            *prefetches
+        ).only(*EMPLOYEE_SERIALIZER_FIELDS)
 
 
 class Employee(Base):
@@ -32,12 +83,19 @@ class Employee(Base):
     permission_groups = models.ManyToManyField(PermissionGroup)
     invitation_accepted = models.BooleanField(default=False)
 
+    objects = EmployeeQuerySet.as_manager()
+
     def __str__(self):
         return self.first_name +" "+ self.last_name
 
     class Meta(Base.Meta):
         default_permissions = ()
 
+        indexes = [
+            # seek key of cursor paginated organization listings
+            models.Index(fields=['organization', 'id']),
+        ]
+
         permissions = (
             ("add_employee", "Can add employee"),
             ("change_employee", "Can change employee"),
@@ -72,7 +130,8 @@ class EmployeeTrackerInfo(models.Model):
 
 def screenshot_path(instance, filename):
     # file will be uploaded to MEDIA_ROOT/employee_screenshot/<year>/<month>/<day>/<employee slug>/<filename>
-    
+    # unless the field storage renames it (screenshot_storage keeps only the extension)
+
     return 'employee_screenshot/{year}/{month}/{day}/{slug}/{filename}'.format(
         year = timezone.now().year,
         month = timezone.now().month,
@@ -82,7 +141,117 @@ def screenshot_path(instance, filename):
     )
 
 
+def screenshot_variant_path(instance, filename):
+    # file will be uploaded to MEDIA_ROOT/employee_screenshot_variants/<year>/<month>/<day>/<employee slug>/<filename>
+
+    return 'employee_screenshot_variants/{year}/{month}/{day}/{slug}/{filename}'.format(
+        year = instance.datetime.year,
+        month = instance.datetime.month,
+        day = instance.datetime.day,
+        slug = instance.employee.slug,
+        filename = filename
+    )
+
+
 class EmployeeScreenshot(models.Model):
     employee = models.ForeignKey(Employee, on_delete=models.CASCADE, related_name='employee_screen_short')
     datetime = models.DateTimeField()
-    screenshot = models.ImageField(upload_to=screenshot_path)
\ No newline at end of file
+    screenshot = models.ImageField(upload_to=screenshot_path, storage=screenshot_storage)
+    thumbnail = models.ImageField(upload_to=screenshot_variant_path, storage=screenshot_storage, blank=True)
+    compact = models.ImageField(upload_to=screenshot_variant_path, storage=screenshot_storage, blank=True)
+    perceptual_hash = models.CharField(max_length=16, blank=True)
+    is_near_duplicate = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['employee', 'datetime']),
+        ]
+
+    @property
+    def file_names(self):
+        return [f.name for f in (self.screenshot, self.thumbnail, self.compact) if f.name]
+
+
+class ScreenshotFile(models.Model):
+    """
+    Reference count of a content addressed screenshot file, the file is
+    deleted once no screenshot refers to it
+    """
+    name = models.CharField(max_length=255, unique=True)
+    ref_count = models.PositiveIntegerField(default=0)
+
+class EmployeeSearchTerm(models.Model):
+    """
+    Trigram index over employee names and email address used by employee search
+    """
+    organization = models.ForeignKey(Organization, on_delete=models.CASCADE, related_name='+')
+    employee = models.ForeignKey(Employee, on_delete=models.CASCADE, related_name='search_terms')
+    term = models.CharField(max_length=3)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['organization', 'term']),
+        ]
+
+
+OUTBOX_STATUSES = (
+    ('pending', 'Pending'),
+    ('sending', 'Sending'),
+    ('sent', 'Sent'),
+    ('failed', 'Failed'),
+)
+
+
+class OutboxEmail(models.Model):
+    """
+    Email written in the same transaction as the change that triggered it,
+    delivered by the send_outbox_emails command
+    """
+    reference = models.CharField(max_length=255, blank=True, db_index=True)
+    subject = models.CharField(max_length=255)
+    body = models.TextField(blank=True)
+    html_message = models.TextField(blank=True)
+    from_email = models.CharField(max_length=254)
+    recipients = models.TextField()
+    status = models.CharField(max_length=16, choices=OUTBOX_STATUSES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
+
+    def __str__(self):
+        return self.subject
+
+    @property
+    def recipient_list(self):
+        return [email for email in self.recipients.split(',') if email]
+
+
+class EmployeePermissionSet(models.Model):
+    """
+    Effective permissions of an employee materialized from its permission
+    groups, stored as codenames and as a bitset of permission ids
+    """
+    employee = models.OneToOneField(Employee, on_delete=models.CASCADE, related_name='permission_set')
+    codenames = models.TextField(blank=True)
+    bitset = models.BinaryField(default=b'')
+    version = models.PositiveIntegerField(default=1)
+
+    @cached_property
+    def codename_set(self):
+        return frozenset(self.codenames.split())
+
+    def has_permission(self, codename):
+        return codename in self.codename_set
+
+    def has_permission_id(self, permission_id):
+        bitset = bytes(self.bitset)
+        index = permission_id >> 3
+
+        return index < len(bitset) and bool(bitset[index] & (1 << (permission_id & 7)))
@@ -0,0 +1,154 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import OutboxEmail
+
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = getattr(settings, 'OUTBOX_EMAIL_MAX_ATTEMPTS', 5)
+
+# delay before the first retry, doubled on every further attempt
+RETRY_DELAY = getattr(settings, 'OUTBOX_EMAIL_RETRY_DELAY', 60)
+
+# seconds a claimed email is left to its sender, emails of a sender that
+# died are claimed again afterwards and may be sent twice
+CLAIM_TIMEOUT = getattr(settings, 'OUTBOX_EMAIL_CLAIM_TIMEOUT', 300)
+
+
+def build_email(subject, recipients, html_message='', body='', from_email=None, reference=''):
+    """Returns an unsaved outbox email, used to queue emails in bulk
+    """
+    return OutboxEmail(
+        reference=reference,
+        subject=subject,
+        body=body,
+        html_message=html_message,
+        from_email=from_email or settings.DEFAULT_FROM_EMAIL,
+        recipients=','.join(recipients)
+    )
+
+
+def queue_email(subject, recipients, html_message='', body='', from_email=None, reference=''):
+    """Writes an email to the outbox, it is sent only if the surrounding
+    transaction commits
+    """
+    outbox_email = build_email(subject, recipients, html_message, body, from_email, reference)
+    outbox_email.save()
+
+    return outbox_email
+
+
+def build_message(outbox_email, connection):
+    message = EmailMultiAlternatives(
+        outbox_email.subject,
+        outbox_email.body,
+        outbox_email.from_email,
+        outbox_email.recipient_list,
+        connection=connection
+    )
+
+    if outbox_email.html_message:
+        message.attach_alternative(outbox_email.html_message, 'text/html')
+
+    return message
+
+
+UPDATE_FIELDS = ['attempts', 'status', 'sent_at', 'next_attempt_at', 'last_error']
+
+
+def record_failure(outbox_email, error):
+    """counts a failed attempt, the email is retried after a growing delay
+    until MAX_ATTEMPTS
+    """
+    outbox_email.attempts += 1
+    outbox_email.last_error = str(error)
+
+    if outbox_email.attempts >= MAX_ATTEMPTS:
+        outbox_email.status = 'failed'
+    else:
+        outbox_email.status = 'pending'
+        delay = RETRY_DELAY * 2 ** (outbox_email.attempts - 1)
+        outbox_email.next_attempt_at = timezone.now() + timedelta(seconds=delay)
+
+    outbox_email.save(update_fields=UPDATE_FIELDS)
+
+
+def claim_emails(batch_size):
+    """Marks up to batch_size due emails as sending in a short transaction
+    and returns them, concurrent senders claim other emails
+    """
+    now = timezone.now()
+
+    with transaction.atomic():
+        ids = list(
+            OutboxEmail.objects.select_for_update(skip_locked=True).filter(
+                Q(status='pending') | Q(status='sending'),
+                next_attempt_at__lte=now
+            ).order_by('next_attempt_at').values_list('id', flat=True)[:batch_size]
+        )
+
+        if not ids:
+            return []
+
+        OutboxEmail.objects.filter(id__in=ids).update(
+            status='sending',
+            next_attempt_at=now + timedelta(seconds=CLAIM_TIMEOUT)
+        )
+
+    return list(OutboxEmail.objects.filter(id__in=ids).order_by('id'))
+
+
+def send_pending_emails(batch_size=100):
+    """Sends due outbox emails over a single connection, failed emails are
+    retried with exponential backoff up to MAX_ATTEMPTS times
+
+    Emails are claimed before the connection is opened and each one is
+    marked sent or failed on its own, no transaction is held while sending
+
+    Returns the number of emails sent
+    """
+    sent = 0
+
+    outbox_emails = claim_emails(batch_size)
+
+    if not outbox_emails:
+        return sent
+
+    connection = get_connection()
+
+    try:
+        connection.open()
+    except Exception as e:
+        # relay unreachable, the whole batch counts as a failed attempt
+        logger.warning('Unable to open email connection: %s', e)
+
+        for outbox_email in outbox_emails:
+            record_failure(outbox_email, e)
+
+        return sent
+
+    try:
+        for outbox_email in outbox_emails:
+            try:
+                build_message(outbox_email, connection).send()
+            except Exception as e:
+                logger.warning('Unable to send outbox email %s: %s', outbox_email.pk, e)
+                record_failure(outbox_email, e)
+            else:
+                outbox_email.attempts += 1
+                outbox_email.status = 'sent'
+                outbox_email.sent_at = timezone.now()
+                outbox_email.last_error = ''
+                outbox_email.save(update_fields=UPDATE_FIELDS)
+                sent += 1
+    finally:
+        connection.close()
+
+    return sent
@@ -0,0 +1,71 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .cache_stamps import get_stamp, bump_stamps
+
+
+# seconds a permission decision is reused across requests
+DECISION_TTL = getattr(settings, 'PERMISSION_DECISION_TTL', 60)
+
+
+def version_key(organization_id):
+    return 'permission-version:%s' % organization_id
+
+
+def organization_version(organization_id):
+    """Returns the version stamp of an organization's permission decisions
+    """
+    return get_stamp(version_key(organization_id))
+
+
+def user_version_key(user_id):
+    return 'permission-user-version:%s' % user_id
+
+
+def invalidate_permission_decisions(organization_ids):
+    """Drops cached decisions of the given organizations by moving them to a
+    new version stamp once the current transaction commits
+    """
+    keys = [version_key(organization_id) for organization_id in set(organization_ids)]
+    transaction.on_commit(lambda: bump_stamps(keys))
+
+
+def invalidate_user_permission_decisions(user_ids):
+    """Drops cached decisions of the given users in every organization once
+    the current transaction commits
+    """
+    keys = [user_version_key(user_id) for user_id in set(user_ids)]
+    transaction.on_commit(lambda: bump_stamps(keys))
+
+
+def cached_decision(request, user, organization_id, codename, decide):
+    """Returns decide() memoized for the request and cached across requests
+    by (user, organization, codename), until the organization or the user
+    is invalidated
+    """
+    key = (user.pk, organization_id, codename)
+
+    memo = None
+    if request is not None:
+        memo = getattr(request, '_permission_decisions', None)
+        if memo is None:
+            memo = request._permission_decisions = {}
+
+        if key in memo:
+            return memo[key]
+
+    cache_key = 'permission-decision:%s:%s:%s:%s:%s' % (
+        organization_id, organization_version(organization_id),
+        user.pk, get_stamp(user_version_key(user.pk)), codename
+    )
+
+    decision = cache.get(cache_key)
+    if decision is None:
+        decision = bool(decide())
+        cache.set(cache_key, decision, DECISION_TTL)
+
+    if memo is not None:
+        memo[key] = decision
+
+    return decision
@@ -0,0 +1,26 @@
+from .models import Employee
+from .effective_permissions import get_permission_set
+from .permission_cache import cached_decision
+
+
+def user_has_permission(user, organization_id, codename, request=None):
+    """Checks codename against the effective permissions of the user's
+    employee record in an organization, owners hold every permission
+
+    Decisions are memoized on request and cached across requests
+    """
+    if user.is_superuser:
+        return True
+
+    def decide():
+        employee = Employee.objects.filter(
+            user=user, organization_id=organization_id
+        ).select_related('permission_set').first()
+
+        if employee is None:
+            return False
+
+        return get_permission_set(employee).has_permission(codename)
+
+    return cached_decision(request, user, organization_id, codename, decide)
+
@@ -0,0 +1,74 @@
+from collections import Counter
+
+from django.db import transaction, IntegrityError
+from django.db.models import F
+
+from .models import ScreenshotFile
+from .storage import screenshot_storage
+
+
+def retain_files(names):
+    """Adds a reference to each of the given stored file names
+    """
+    for name, count in Counter(name for name in names if name).items():
+        updated = ScreenshotFile.objects.filter(name=name).update(ref_count=F('ref_count') + count)
+
+        if updated:
+            continue
+
+        try:
+            with transaction.atomic():
+                ScreenshotFile.objects.create(name=name, ref_count=count)
+        except IntegrityError:
+            ScreenshotFile.objects.filter(name=name).update(ref_count=F('ref_count') + count)
+
+
+def lock_file(name):
+    """Locks the reference count row of a stored file name until the current
+    transaction ends, the row is created without references when missing
+    """
+    return ScreenshotFile.objects.select_for_update().get_or_create(
+        name=name, defaults={'ref_count': 0}
+    )[0]
+
+
+def delete_unreferenced_file(name):
+    """Deletes a stored file and its row under the row lock unless a
+    screenshot refers to it, writers of the same content wait for the lock
+    """
+    with transaction.atomic():
+        screenshot_file = lock_file(name)
+
+        if screenshot_file.ref_count > 0:
+            return
+
+        screenshot_file.delete()
+        screenshot_storage.delete(name)
+
+
+def discard_files(names):
+    """Deletes files written for rows that were rolled back, files a
+    screenshot refers to are kept
+    """
+    for name in set(name for name in names if name):
+        delete_unreferenced_file(name)
+
+
+def release_files(names):
+    """Drops a reference to each of the given stored file names, files left
+    without references are deleted after commit
+    """
+    with transaction.atomic():
+        for name, count in Counter(name for name in names if name).items():
+            screenshot_file = ScreenshotFile.objects.select_for_update().filter(name=name).first()
+
+            if screenshot_file is None:
+                continue
+
+            ScreenshotFile.objects.filter(pk=screenshot_file.pk).update(
+                ref_count=F('ref_count') - min(count, screenshot_file.ref_count)
+            )
+
+            # the row stays at zero references until the file is deleted
+            if screenshot_file.ref_count <= count:
+                transaction.on_commit(lambda name=name: delete_unreferenced_file(name))
@@ -0,0 +1,157 @@
+import io
+import os
+import logging
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction, close_old_connections
+
+from PIL import Image
+
+from .models import EmployeeScreenshot
+from .screenshot_files import retain_files, discard_files
+from .executors import LazyExecutor
+
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_SIZE = getattr(settings, 'EMPLOYEE_SCREENSHOT_THUMBNAIL_SIZE', (320, 320))
+THUMBNAIL_QUALITY = getattr(settings, 'EMPLOYEE_SCREENSHOT_THUMBNAIL_QUALITY', 70)
+
+COMPACT_SIZE = getattr(settings, 'EMPLOYEE_SCREENSHOT_COMPACT_SIZE', (1280, 1280))
+COMPACT_FORMAT = getattr(settings, 'EMPLOYEE_SCREENSHOT_COMPACT_FORMAT', 'WEBP')
+COMPACT_QUALITY = getattr(settings, 'EMPLOYEE_SCREENSHOT_COMPACT_QUALITY', 60)
+
+WORKERS = getattr(settings, 'EMPLOYEE_SCREENSHOT_WORKERS', 2)
+
+# hamming distance between perceptual hashes under which a screenshot is
+# flagged as a near duplicate of the previous one, None disables flagging
+NEAR_DUPLICATE_DISTANCE = getattr(settings, 'EMPLOYEE_SCREENSHOT_NEAR_DUPLICATE_DISTANCE', None)
+
+EXTENSIONS = {
+    'JPEG': 'jpg',
+    'WEBP': 'webp',
+    'PNG': 'png',
+}
+
+get_executor = LazyExecutor(WORKERS, 'screenshot-variants')
+
+
+def render_variant(image, size, image_format, quality):
+    """Returns image downscaled to fit size and encoded with image_format
+    """
+    variant = image.copy()
+    variant.thumbnail(size, Image.LANCZOS)
+
+    if variant.mode not in ('RGB', 'L'):
+        variant = variant.convert('RGB')
+
+    output = io.BytesIO()
+    variant.save(output, format=image_format, quality=quality, optimize=True)
+
+    return output.getvalue()
+
+
+def perceptual_hash(image):
+    """Returns the 64 bit difference hash of image as hex
+    """
+    small = image.convert('L').resize((9, 8), Image.LANCZOS)
+    pixels = list(small.getdata())
+
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            bits = (bits << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+
+    return '%016x' % bits
+
+
+def is_near_duplicate(screenshot, hash_value):
+    """Compares hash_value with the previous screenshot of the same employee
+    """
+    if NEAR_DUPLICATE_DISTANCE is None:
+        return False
+
+    previous_hash = EmployeeScreenshot.objects.filter(
+        employee_id=screenshot.employee_id,
+        datetime__lt=screenshot.datetime
+    ).exclude(
+        perceptual_hash=''
+    ).order_by('-datetime').values_list('perceptual_hash', flat=True).first()
+
+    if not previous_hash:
+        return False
+
+    distance = bin(int(previous_hash, 16) ^ int(hash_value, 16)).count('1')
+
+    return distance <= NEAR_DUPLICATE_DISTANCE
+
+
+def generate_variants(screenshot):
+    """Creates thumbnail and compact variants of a screenshot
+    """
+    base_name = os.path.splitext(os.path.basename(screenshot.screenshot.name))[0]
+
+    with screenshot.screenshot.open('rb') as original:
+        image = Image.open(original)
+        image.load()
+
+    thumbnail = render_variant(image, THUMBNAIL_SIZE, 'JPEG', THUMBNAIL_QUALITY)
+    compact = render_variant(image, COMPACT_SIZE, COMPACT_FORMAT, COMPACT_QUALITY)
+
+    hash_value = perceptual_hash(image)
+
+    # the variant files stay locked by the storage until the row refers to them
+    with transaction.atomic():
+        screenshot.thumbnail.save(
+            '%s_thumbnail.jpg' % base_name, ContentFile(thumbnail), save=False
+        )
+        screenshot.compact.save(
+            '%s_compact.%s' % (base_name, EXTENSIONS.get(COMPACT_FORMAT, COMPACT_FORMAT.lower())),
+            ContentFile(compact), save=False
+        )
+
+        updated = EmployeeScreenshot.objects.filter(pk=screenshot.pk).update(
+            thumbnail=screenshot.thumbnail.name,
+            compact=screenshot.compact.name,
+            perceptual_hash=hash_value,
+            is_near_duplicate=is_near_duplicate(screenshot, hash_value)
+        )
+
+        if updated:
+            retain_files([screenshot.thumbnail.name, screenshot.compact.name])
+
+    # the screenshot was deleted while its variants were rendered
+    if not updated:
+        discard_files([screenshot.thumbnail.name, screenshot.compact.name])
+
+
+def process_screenshots(screenshot_ids):
+    """Worker entry point, generating variants of screenshots still missing them
+    """
+    close_old_connections()
+
+    try:
+        screenshots = EmployeeScreenshot.objects.filter(
+            id__in=screenshot_ids, thumbnail=''
+        ).select_related('employee')
+
+        for screenshot in screenshots:
+            try:
+                generate_variants(screenshot)
+            except Exception:
+                logger.exception('Unable to generate variants of screenshot %s', screenshot.pk)
+    finally:
+        close_old_connections()
+
+
+def schedule_variants(screenshot_ids):
+    """Queues variant generation on the worker pool once the current
+    transaction commits
+    """
+    screenshot_ids = [pk for pk in screenshot_ids if pk is not None]
+
+    if not screenshot_ids:
+        return
+
+    transaction.on_commit(lambda: get_executor().submit(process_screenshots, screenshot_ids))
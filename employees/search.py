@@ -0,0 +1,96 @@
+import re
+
+from django.db import transaction
+from django.db.models import Count, Q, Value as V
+from django.db.models.functions import Concat
+
+from .models import Employee, EmployeeSearchTerm
+
+
+TOKEN_RE = re.compile(r'[^\w]+')
+
+
+def trigrams(text):
+    """Returns trigrams of every word in text, words are padded like pg_trgm
+    (two spaces before, one after) so short prefixes still produce terms
+    """
+    terms = set()
+
+    for word in TOKEN_RE.split((text or '').lower()):
+        if not word:
+            continue
+
+        padded = '  ' + word + ' '
+        for i in range(len(padded) - 2):
+            terms.add(padded[i:i + 3])
+
+    return terms
+
+
+def query_trigrams(q):
+    """Unpadded trigrams of each word of a search query, every one of them
+    is a term of any text containing q
+    """
+    terms = set()
+
+    for word in TOKEN_RE.split((q or '').lower()):
+        for i in range(len(word) - 2):
+            terms.add(word[i:i + 3])
+
+    return terms
+
+
+def employee_terms(employee):
+    text = ' '.join([employee.first_name or '', employee.last_name or '', employee.user.email or ''])
+    return trigrams(text)
+
+
+def index_employees(employee_ids):
+    """Rebuilds search terms of the given employees
+    """
+    employee_ids = list(employee_ids)
+    if not employee_ids:
+        return
+
+    with transaction.atomic():
+        employees = Employee.objects.filter(id__in=employee_ids).select_related('user').only(
+            'id', 'organization_id', 'first_name', 'last_name', 'user__email'
+        )
+
+        search_terms = []
+        for employee in employees:
+            for term in employee_terms(employee):
+                search_terms.append(EmployeeSearchTerm(
+                    organization_id=employee.organization_id,
+                    employee_id=employee.id,
+                    term=term
+                ))
+
+        EmployeeSearchTerm.objects.filter(employee_id__in=employee_ids).delete()
+        EmployeeSearchTerm.objects.bulk_create(search_terms, batch_size=1000)
+
+
+def search_employees(queryset, organization, q):
+    """Filters queryset to employees whose full name or email contains q,
+    the trigram index narrows the candidates when q has a word of three or
+    more characters
+    """
+    queryset = queryset.annotate(
+        search=Concat('first_name', V(' '), 'last_name')
+    ).filter(Q(search__icontains=q) | Q(user__email__icontains=q))
+
+    terms = query_trigrams(q)
+
+    if terms:
+        candidates = EmployeeSearchTerm.objects.filter(
+            organization=organization,
+            term__in=terms
+        ).values('employee_id').annotate(
+            matches=Count('term', distinct=True)
+        ).filter(
+            matches=len(terms)
+        ).values('employee_id')
+
+        queryset = queryset.filter(id__in=candidates)
+
+    return queryset
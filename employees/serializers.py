@@ -1,9 +1,10 @@
 import uuid
 
 from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
 from django.utils.text import slugify
-from django.contrib.auth import authenticate
-from django.core.mail import send_mail
 from django.template.loader import render_to_string
 from django.utils.encoding import force_bytes, force_text
 from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
@@ -16,10 +17,17 @@ from organizations.models import Organization, Branch
 from accounts.models import User
 from accounts.serializers import UserSerializer
 from .models import Employee, EmployeeScreenshot
-from general.validators import is_postcode_valid
+from .outbox import build_email
+from .geo import geo_index, postcode_valid
+from .effective_permissions import get_permission_set
+from .search import index_employees
+from .login import authenticate_remembered
+from .screenshot_files import discard_files
 from general.token_generator import account_activation_token
 
 from departments.serializers import DesignationSerializer, DepartmentSerializer
+from departments.fieldsets import SparseFieldsetMixin
+from departments.org_chart import invalidate_organization_chart
 from organizations.serializers import BranchSerializer
 
 
@@ -27,7 +35,7 @@ from organizations.serializers import BranchSerializer
 from phonenumber_field.serializerfields import PhoneNumberField
 
 
-class EmployeeSerializer(serializers.ModelSerializer):
+class EmployeeSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     """serializer to create, update, retrive , delete employee of 
     an organization or branch
     """
@@ -37,6 +45,8 @@ class EmployeeSerializer(serializers.ModelSerializer):
     designation = serializers.SlugRelatedField(queryset=Designation.objects.all(), slug_field='slug')
     phone = PhoneNumberField(allow_blank=True, allow_null=True)
 
+    expandable_fields = ('designation', 'branch', 'department')
+
     class Meta:
         model = Employee
         fields = ['slug', 'organization', 'branch', 'department', 'designation', 'photo', 
@@ -48,43 +58,48 @@ class EmployeeSerializer(serializers.ModelSerializer):
 
         data = super().to_representation(obj)
 
-        if obj.nationality:
+        if self.wants('nationality') and obj.nationality:
             data['nationality'] = {
                 'id': obj.nationality.id,
                 'name_ascii' : obj.nationality.name_ascii
             }
 
-        if obj.state:
+        if self.wants('state') and obj.state:
             data['state'] = {
                 'id': obj.state.id,
                 'name_ascii' : obj.state.name_ascii
             }
 
-        if obj.city:
+        if self.wants('city') and obj.city:
             data['city'] = {
                 'id': obj.city.id,
                 'name_ascii': obj.city.name_ascii
             }
         data['email'] = obj.user.email
         data['id'] = obj.id
-        data['designation'] = DesignationSerializer(obj.designation).data
 
-        if hasattr(obj.branch, 'branch_name'):
-            data['branch'] = BranchSerializer(obj.branch).data
-        else:
-            data['branch'] = None
+        # sections left out of expand= keep the slug of the related object
+        if self.should_expand('designation'):
+            data['designation'] = DesignationSerializer(obj.designation).data
+
+        if self.should_expand('branch'):
+            if hasattr(obj.branch, 'branch_name'):
+                data['branch'] = BranchSerializer(obj.branch).data
+            else:
+                data['branch'] = None
 
-        if hasattr(obj.department, 'department_name'):
-            data['department'] = DepartmentSerializer(obj.department).data
-        else:
-            data['department'] = None
+        if self.should_expand('department'):
+            if hasattr(obj.department, 'department_name'):
+                data['department'] = DepartmentSerializer(obj.department).data
+            else:
+                data['department'] = None
 
         data['status'] = obj.employee_status
         data['invitation_accepted'] = obj.invitation_accepted
         data['is_owner'] = obj.user.is_superuser
 
 
-        return data
+        return self.sparse(data)
 
     def validate(self, data):
         """vaidating nationality, state, city 
@@ -95,10 +110,10 @@ class EmployeeSerializer(serializers.ModelSerializer):
         pin_code = data.get("pin_code")
 
         if state:
-            state_exists = State.objects.filter(
-                pk=state.pk, 
-                country=nationality
-            ).exists()
+            state_exists = geo_index.state_in_country(
+                state.pk, 
+                nationality.pk if nationality else None
+            )
         
             if not state_exists:
                 raise serializers.ValidationError({
@@ -106,10 +121,10 @@ class EmployeeSerializer(serializers.ModelSerializer):
                     })
 
         if city:
-            city_exists = City.objects.filter(
-                pk=city.pk, 
-                region=state
-            ).exists()
+            city_exists = geo_index.city_in_state(
+                city.pk, 
+                state.pk if state else None
+            )
 
             if not city_exists:
                 raise serializers.ValidationError({
@@ -119,7 +134,7 @@ class EmployeeSerializer(serializers.ModelSerializer):
         # validating postal code related to country
         if pin_code and nationality:
 
-            if not is_postcode_valid(pin_code, nationality.code2):
+            if not postcode_valid(pin_code, nationality.code2):
 
                 raise serializers.ValidationError("Invalid pincode")
 
@@ -185,11 +200,15 @@ class EmployeeSerializer(serializers.ModelSerializer):
         return employee
 
     def update(self, instance, validated_data):
+        """updates an employee, an owner's changes are copied to their user
+        profile and their employee records in other organizations with one
+        UPDATE each, so the query count does not grow with the number of
+        organizations
+        """
         user = self.context['request'].user
-        
+
+        validated_data['updated_by'] = user
         instance = super().update(instance, validated_data)
-        instance.updated_by = user
-        instance.save()
         
         # Mapping userprofile 
         if instance.user.is_superuser:
@@ -204,24 +223,32 @@ class EmployeeSerializer(serializers.ModelSerializer):
             instance.user.user_profile.save()
 
             # mapping same owner employee in other organizations
-            obj_list=Employee.objects.filter(user=user).exclude(id=instance.id)
-            if obj_list :
-                for obj in obj_list:
-                    obj.first_name=instance.first_name
-                    obj.last_name=instance.last_name
-                    obj.phone=instance.phone
-                    obj.photo=instance.photo
-                    obj.nationality_id=instance.nationality_id
-                    obj.state_id=instance.state_id
-                    obj.city_id=instance.city_id
-                    obj.house_name=instance.house_name
-                    obj.street_name=instance.street_name
-                    obj.locality_name=instance.locality_name
-                    obj.pin_code=instance.pin_code
-                    obj.invitation_accepted=instance.invitation_accepted
-                    
-                    obj.save()
-                    
+            organization_ids = dict(Employee.objects.filter(
+                user=instance.user
+            ).exclude(id=instance.id).values_list('id', 'organization_id'))
+
+            if organization_ids:
+                Employee.objects.filter(id__in=organization_ids).update(
+                    first_name=instance.first_name,
+                    last_name=instance.last_name,
+                    phone=instance.phone,
+                    photo=instance.photo.name,
+                    nationality_id=instance.nationality_id,
+                    state_id=instance.state_id,
+                    city_id=instance.city_id,
+                    house_name=instance.house_name,
+                    street_name=instance.street_name,
+                    locality_name=instance.locality_name,
+                    pin_code=instance.pin_code,
+                    invitation_accepted=instance.invitation_accepted,
+                    updated=timezone.now(),
+                    updated_by=user
+                )
+
+                # update() skips post_save, names are reindexed and the
+                # headcounts of every affected organization refreshed here
+                index_employees(organization_ids)
+                invalidate_organization_chart(organization_ids.values())
 
         return instance
 
@@ -235,8 +262,8 @@ class InviteEmployeeSerializer(serializers.Serializer):
     class Meta:
         fields = ['invite_url', 'site_name']
 
-    def send_invitation_email(self, employee):
-        """send a invitation email to employee email address
+    def invitation_email(self, employee):
+        """returns the unsaved outbox invitation email of an employee
         """
         token = account_activation_token.make_token(employee.user)
 
@@ -252,14 +279,17 @@ class InviteEmployeeSerializer(serializers.Serializer):
 
         subject = 'Welcome ' + employee.first_name + ' ' + employee.last_name
 
-        send_mail(subject,
-            '',
-            settings.DEFAULT_FROM_EMAIL,
+        return build_email(subject,
             [employee.user.email],
             html_message = html_message,
-            fail_silently=False
+            reference = 'employee-invitation:%s' % employee.slug
         )
 
+    def send_invitation_email(self, employee):
+        """send a invitation email to employee email address
+        """
+        self.invitation_email(employee).save()
+
     def save(self, employee=None):
         self.send_invitation_email(employee)
 
@@ -324,17 +354,12 @@ class EmployeePermissionSerializer(serializers.ModelSerializer):
 
     def to_representation(self, obj):
         data = super().to_representation(obj)
-        permissions_list=[]
         data['permission_groups'] = obj.permission_groups.all().values(
             'slug', 
             'group_name'
         )
 
-        for i in obj.permission_groups.all():
-            for perm in i.permissions.all():
-                permissions_list.append(perm.codename)
-
-        data['all_permissions']=permissions_list
+        data['all_permissions'] = sorted(get_permission_set(obj).codename_set)
         data['designationName']=obj.designation.designation_name
 
         return data
@@ -354,7 +379,7 @@ class EmployeeLoginSerializer(serializers.Serializer):
         password = data['password']
 
         if email and password:
-            user = authenticate(username=email, password=password)
+            user = authenticate_remembered(email, password)
 
             if user:
                 if hasattr(user, 'employee_user'):
@@ -373,7 +398,8 @@ class EmployeeScreenshotSerializer(serializers.ModelSerializer):
     slug = serializers.CharField(source='employee.slug')
     class Meta:
         model = EmployeeScreenshot
-        fields = ('id', 'slug', 'datetime', 'screenshot')
+        fields = ('id', 'slug', 'datetime', 'screenshot', 'thumbnail', 'compact')
+        read_only_fields = ('thumbnail', 'compact')
 
     def create(self, validated_data):
         """Overriding default create method to create employee screenshort
@@ -387,6 +413,92 @@ class EmployeeScreenshotSerializer(serializers.ModelSerializer):
             screenshot = validated_data['screenshot']
             )
 
-        employee_screenshot_obj.save()
+        # the stored file stays locked until post_save adds its reference
+        try:
+            with transaction.atomic():
+                employee_screenshot_obj.save()
+        except Exception:
+            if employee_screenshot_obj.screenshot._committed:
+                discard_files([employee_screenshot_obj.screenshot.name])
+            raise
+
+        return employee_screenshot_obj
+
+
+class EmployeeScreenshotBatchItemSerializer(serializers.Serializer):
+    """Serializer to validate one screenshot of a batch upload
+    """
+    slug = serializers.CharField()
+    datetime = serializers.DateTimeField()
+    screenshot = serializers.ImageField()
+
+
+def requester_organizations(request):
+    """organizations the requesting user owns or holds an employee record in
+    """
+    return Organization.objects.filter(
+        Q(created_by=request.user) |
+        Q(id__in=Employee.objects.filter(user=request.user).values('organization_id'))
+    )
+
 
-        return employee_screenshot_obj
\ No newline at end of file
+class EmployeeScreenshotRangeSerializer(serializers.Serializer):
+    """Serializer to validate a time range of an employee's screenshots,
+    employees are looked up in the requester's organizations
+    """
+    employee = serializers.SlugRelatedField(queryset=Employee.objects.none(), slug_field='slug')
+    start = serializers.DateTimeField()
+    end = serializers.DateTimeField()
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['employee'].queryset = Employee.objects.filter(
+            organization__in=requester_organizations(self.context['request'])
+        )
+
+    def validate(self, data):
+        """validating start is before end
+        """
+        if data['start'] >= data['end']:
+            raise serializers.ValidationError({
+                'end': 'end must be after start'
+            })
+
+        return data
+
+
+class EmployeeScreenshotOrganizationSerializer(serializers.Serializer):
+    """Serializer to validate organization of latest screenshots listing,
+    one of the requester's organizations
+    """
+    organization = serializers.SlugRelatedField(queryset=Organization.objects.none(), slug_field='slug')
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['organization'].queryset = requester_organizations(self.context['request'])
+
+
+class EmployeeImportSerializer(serializers.Serializer):
+    """Serializer to validate a bulk employee import request
+    """
+    organization = serializers.SlugRelatedField(queryset=Organization.objects.all(), slug_field='slug')
+    file = serializers.FileField()
+    invite_url = serializers.URLField()
+    site_name = serializers.CharField()
+    dry_run = serializers.BooleanField(default=False)
+
+    def validate_file(self, value):
+        """validating file is csv or jsonl
+        """
+        if not value.name.lower().endswith(('.csv', '.jsonl')):
+            raise serializers.ValidationError('Only csv and jsonl files can be imported')
+
+        return value
+
+
+class EmployeeStatusBulkChangeSerializer(serializers.Serializer):
+    """Serializer to validate a status change of many employees
+    """
+    organization = serializers.SlugRelatedField(queryset=Organization.objects.all(), slug_field='slug')
+    employees = serializers.ListField(child=serializers.CharField(), allow_empty=False)
+    status = serializers.ChoiceField(choices=['active', 'inactive'])
@@ -0,0 +1,205 @@
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from general.models import Country, State, City, PermissionGroup
+from organizations.models import Organization
+from rest_framework.authtoken.models import Token
+
+from accounts.models import User
+from departments.models import Designation
+from .models import Employee, EmployeeScreenshot
+from .search import index_employees
+from .screenshot_variants import schedule_variants
+from .screenshot_files import retain_files, release_files
+from .geo import invalidate_geo_index
+from .effective_permissions import rebuild_permission_sets, rebuild_group_permission_sets
+from .permission_cache import invalidate_permission_decisions, invalidate_user_permission_decisions
+from .authentication import invalidate_tokens, invalidate_user_tokens
+from .login import password_changed
+
+
+EMPLOYEE_SEARCH_FIELDS = {'first_name', 'last_name', 'organization'}
+
+
+@receiver(post_save, sender=Employee)
+def update_employee_search_terms(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw:
+        return
+
+    if update_fields and not EMPLOYEE_SEARCH_FIELDS.intersection(update_fields):
+        return
+
+    index_employees([instance.id])
+
+
+@receiver(pre_save, sender=User)
+def remember_email_change(sender, instance, raw=False, update_fields=None, **kwargs):
+    instance._email_changed = False
+
+    if raw or instance.pk is None:
+        return
+
+    if update_fields is not None and 'email' not in update_fields:
+        return
+
+    saved_email = User.objects.filter(pk=instance.pk).values_list('email', flat=True).first()
+    instance._email_changed = saved_email is not None and saved_email != instance.email
+
+
+@receiver(post_save, sender=User)
+def update_user_search_terms(sender, instance, created=False, raw=False, **kwargs):
+    # only an email change alters the search terms of a user's employees
+    if raw or created or not getattr(instance, '_email_changed', False):
+        return
+
+    index_employees(Employee.objects.filter(user=instance).values_list('id', flat=True))
+
+
+@receiver(post_save, sender=EmployeeScreenshot)
+def generate_screenshot_variants(sender, instance, created=False, raw=False, **kwargs):
+    if raw or not created:
+        return
+
+    retain_files([instance.screenshot.name])
+    schedule_variants([instance.id])
+
+
+@receiver(post_delete, sender=EmployeeScreenshot)
+def release_screenshot_files(sender, instance, **kwargs):
+    release_files(instance.file_names)
+
+
+@receiver(post_save, sender=Country)
+@receiver(post_delete, sender=Country)
+@receiver(post_save, sender=State)
+@receiver(post_delete, sender=State)
+@receiver(post_save, sender=City)
+@receiver(post_delete, sender=City)
+def invalidate_geo(sender, raw=False, **kwargs):
+    if raw:
+        return
+
+    invalidate_geo_index()
+
+
+def changed_ids(instance, action, pk_set, related_ids):
+    """Returns ids of the instances on the forward side of an m2m change,
+    ids removed by a reverse clear are collected on pre_clear
+    """
+    if action == 'pre_clear':
+        instance._cleared_related_ids = list(related_ids())
+        return []
+
+    if action == 'post_clear':
+        return getattr(instance, '_cleared_related_ids', [])
+
+    return pk_set or []
+
+
+@receiver(m2m_changed, sender=Employee.permission_groups.through)
+def employee_groups_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear', 'post_clear'):
+        return
+
+    if not reverse:
+        if action != 'pre_clear':
+            rebuild_permission_sets([instance.pk])
+        return
+
+    # instance is a permission group and pk_set holds employee ids
+    employee_ids = changed_ids(
+        instance, action, pk_set,
+        lambda: sender.objects.filter(permissiongroup_id=instance.pk).values_list('employee_id', flat=True)
+    )
+    rebuild_permission_sets(employee_ids)
+
+
+@receiver(m2m_changed, sender=PermissionGroup.permissions.through)
+def group_permissions_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear', 'post_clear'):
+        return
+
+    if not reverse:
+        if action != 'pre_clear':
+            rebuild_group_permission_sets([instance.pk])
+        return
+
+    # instance is a permission and pk_set holds permission group ids
+    group_ids = changed_ids(
+        instance, action, pk_set,
+        lambda: sender.objects.filter(permission_id=instance.pk).values_list('permissiongroup_id', flat=True)
+    )
+    rebuild_group_permission_sets(group_ids)
+
+
+@receiver(m2m_changed, sender=Designation.permission_groups.through)
+def designation_groups_changed(sender, instance, action, reverse, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    # instance is a designation or a permission group, both belong to the
+    # organization whose decisions are dropped
+    invalidate_permission_decisions([instance.organization_id])
+
+
+@receiver(post_save, sender=Employee)
+@receiver(post_delete, sender=Employee)
+def invalidate_employee_decisions(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+
+    # the user stamp also covers the organization an employee was moved from
+    invalidate_permission_decisions([instance.organization_id])
+    invalidate_user_permission_decisions([instance.user_id])
+
+
+@receiver(post_save, sender=Organization)
+@receiver(post_delete, sender=Organization)
+def invalidate_organization_decisions(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+
+    invalidate_permission_decisions([instance.pk])
+
+
+@receiver(pre_delete, sender=PermissionGroup)
+def collect_permission_group_members(sender, instance, **kwargs):
+    instance._member_ids = list(Employee.permission_groups.through.objects.filter(
+        permissiongroup_id=instance.pk
+    ).values_list('employee_id', flat=True))
+
+
+@receiver(post_delete, sender=PermissionGroup)
+def permission_group_deleted(sender, instance, **kwargs):
+    # deleting a group removes its m2m rows without m2m_changed
+    rebuild_permission_sets(getattr(instance, '_member_ids', []))
+    invalidate_permission_decisions([instance.organization_id])
+
+
+@receiver(post_save, sender=User)
+def invalidate_cached_user_tokens(sender, instance, created=False, raw=False, update_fields=None, **kwargs):
+    # password, is_active and other user changes must not be served from cache,
+    # last_login updates on every login are ignored
+    if raw or created:
+        return
+
+    if update_fields and set(update_fields) == {'last_login'}:
+        return
+
+    invalidate_user_tokens([instance.pk])
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_deleted_token(sender, instance, **kwargs):
+    invalidate_tokens([instance.key], [instance.user_id])
+
+
+@receiver(post_save, sender=User)
+def forget_failed_logins(sender, instance, created=False, raw=False, **kwargs):
+    if raw or created:
+        return
+
+    # set_password keeps the raw password on the instance until save returns,
+    # views changing is_active call password_changed themselves
+    if getattr(instance, '_password', None) is not None:
+        password_changed(instance.email)
@@ -0,0 +1,56 @@
+import os
+import hashlib
+
+from django.core.files.storage import get_storage_class
+from django.db import transaction
+
+
+class ContentAddressedStorageMixin:
+    """Storage mixin naming files by the sha256 digest of their content,
+    identical files are written once and share the same name
+    """
+    content_prefix = 'content'
+
+    def content_name(self, name, content):
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        digest = digest.hexdigest()
+
+        extension = os.path.splitext(name)[1].lower()
+
+        return '{prefix}/{a}/{b}/{digest}{extension}'.format(
+            prefix=self.content_prefix,
+            a=digest[:2],
+            b=digest[2:4],
+            digest=digest,
+            extension=extension
+        )
+
+    def lock_name(self, name):
+        """Hook locking name against concurrent deletes until the current
+        transaction ends
+        """
+
+    def _save(self, name, content):
+        name = self.content_name(name, content)
+
+        # the write is skipped only while the existing file cannot be deleted
+        with transaction.atomic():
+            self.lock_name(name)
+
+            if self.exists(name):
+                return name
+
+            return super()._save(name, content)
+
+
+class ContentAddressedStorage(ContentAddressedStorageMixin, get_storage_class()):
+    content_prefix = 'employee_screenshot/content'
+
+    def lock_name(self, name):
+        from .screenshot_files import lock_file
+        lock_file(name)
+
+
+screenshot_storage = ContentAddressedStorage()
@@ -1,3 +1,776 @@
-from django.test import TestCase
+import io
+import shutil
+import tempfile
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import Permission
+from django.core import mail
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import transaction
+from django.utils import timezone
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from rest_framework import exceptions
+from rest_framework.authtoken.models import Token
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from PIL import Image
+
+from general.models import Country, State, City, PermissionGroup
+from accounts.models import User, UserProfile
+from organizations.models import Organization
+from departments.models import Designation
+from .models import Employee, EmployeeScreenshot, ScreenshotFile, EmployeePermissionSet, OutboxEmail
+from .effective_permissions import rebuild_permission_sets
+from .permissions import user_has_permission
+from .screenshot_files import retain_files, release_files, delete_unreferenced_file
+from .screenshot_variants import generate_variants
+from .bulk_import import EmployeeImporter, read_rows
+from .geo import geo_index
+from .search import search_employees
+from .login import authenticate_remembered
+from .outbox import queue_email, claim_emails, send_pending_emails
+from .authentication import CachedTokenAuthentication, token_cache, shared_cache_enabled
+from .storage import screenshot_storage
+from .serializers import EmployeeSerializer, EmployeeScreenshotRangeSerializer, EmployeeScreenshotOrganizationSerializer
+from .views import EmployeeViewSet, EmployeeScreenshotBatchCreateAPIView
+
+
+def create_user(email, password='password', **kwargs):
+    return User.objects.create_user(email=email, password=password, **kwargs)
+
+
+def create_organization(owner, name='Organization'):
+    return Organization.objects.create(
+        organization_name=name, created_by=owner, updated_by=owner
+    )
+
+
+def create_employee(organization, email, first_name='John', last_name='Doe', **kwargs):
+    owner = organization.created_by
+    user = kwargs.pop('user', None) or create_user(email)
+
+    if 'designation' not in kwargs:
+        kwargs['designation'] = Designation.objects.create(
+            organization=organization, designation_name='Developer',
+            created_by=owner, updated_by=owner
+        )
+
+    if 'nationality' not in kwargs:
+        kwargs['nationality'] = Country.objects.get_or_create(
+            name='India', name_ascii='India', code2='IN'
+        )[0]
+
+    return Employee.objects.create(
+        user=user, organization=organization, first_name=first_name, last_name=last_name,
+        invitation_accepted=True, created_by=owner, updated_by=owner, **kwargs
+    )
+
+
+def image_content(color='red'):
+    output = io.BytesIO()
+    Image.new('RGB', (8, 8), color).save(output, 'PNG')
+    return output.getvalue()
+
+
+def create_permission_group(organization, *codenames):
+    owner = organization.created_by
+    group = PermissionGroup.objects.create(
+        organization=organization, group_name='Group', created_by=owner, updated_by=owner
+    )
+    group.permissions.set(Permission.objects.filter(
+        content_type__app_label='employees', codename__in=codenames
+    ))
+    return group
+
+
+class UserHasPermissionTest(TransactionTestCase):
+    """cached decisions are dropped as soon as the change they depend on
+    commits
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.owner = create_user('owner@example.com', is_superuser=True)
+        self.organization = create_organization(self.owner)
+        self.group = create_permission_group(self.organization, 'update_status')
+        self.employee = create_employee(self.organization, 'john@example.com')
+        self.employee.permission_groups.add(self.group)
+
+    def has_permission(self):
+        user = User.objects.get(pk=self.employee.user_id)
+        return user_has_permission(user, self.organization.id, 'update_status')
+
+    def test_owner_holds_every_permission(self):
+        self.assertTrue(user_has_permission(self.owner, self.organization.id, 'change_permissions'))
+
+    def test_removed_group_is_denied(self):
+        self.assertTrue(self.has_permission())
+
+        self.employee.permission_groups.remove(self.group)
+
+        self.assertFalse(self.has_permission())
+
+    def test_revoked_group_permission_is_denied(self):
+        self.assertTrue(self.has_permission())
+
+        self.group.permissions.clear()
+
+        self.assertFalse(self.has_permission())
+
+    def test_deleted_group_is_denied(self):
+        self.assertTrue(self.has_permission())
+
+        self.group.delete()
+
+        self.assertFalse(self.has_permission())
+
+    def test_deleted_employee_is_denied(self):
+        self.assertTrue(self.has_permission())
+
+        self.employee.delete()
+
+        self.assertFalse(self.has_permission())
+
+    def test_employee_moved_to_another_organization_is_denied(self):
+        self.assertTrue(self.has_permission())
+
+        self.employee.organization = create_organization(self.owner, 'Other')
+        self.employee.save()
+
+        self.assertFalse(self.has_permission())
+
+    def test_decision_is_memoized_on_request(self):
+        request = type('Request', (), {})()
+        user = User.objects.get(pk=self.employee.user_id)
+
+        self.assertTrue(user_has_permission(user, self.organization.id, 'update_status', request))
+
+        with self.assertNumQueries(0):
+            self.assertTrue(user_has_permission(user, self.organization.id, 'update_status', request))
+
+
+class MediaRootMixin:
+    """points MEDIA_ROOT to a directory removed after each test
+    """
+
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+
+        media_settings = override_settings(MEDIA_ROOT=media_root)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+        # variants are generated by the worker pool, not in tests
+        for target in ('employees.views.schedule_variants', 'employees.signals.schedule_variants'):
+            patcher = mock.patch(target)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+
+@mock.patch('employees.views.connection.features.can_return_ids_from_bulk_insert', False)
+class ScreenshotBatchCreateTest(MediaRootMixin, TransactionTestCase):
+
+    def setUp(self):
+        super().setUp()
+        owner = create_user('owner@example.com', is_superuser=True)
+        self.employee = create_employee(create_organization(owner), 'john@example.com')
+        self.contents = [image_content('red'), image_content('blue')]
+
+    def post(self):
+        request = APIRequestFactory().post('/', {
+            'slug': self.employee.slug,
+            'datetime': ['2020-01-01T10:00:00Z', '2020-01-01T10:05:00Z'],
+            'screenshot': [
+                SimpleUploadedFile('%d.png' % index, content, 'image/png')
+                for index, content in enumerate(self.contents)
+            ],
+        }, format='multipart')
+        force_authenticate(request, self.employee.user)
+
+        return EmployeeScreenshotBatchCreateAPIView.as_view()(request)
+
+    def stored_names(self):
+        return [screenshot_storage.content_name('shot.png', ContentFile(content)) for content in self.contents]
+
+    def test_created_rows_are_returned_with_their_ids(self):
+        response = self.post()
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            [result['id'] for result in response.data['results']],
+            list(EmployeeScreenshot.objects.order_by('id').values_list('id', flat=True))
+        )
+        self.assertEqual(
+            set(ScreenshotFile.objects.values_list('name', 'ref_count')),
+            {(name, 1) for name in self.stored_names()}
+        )
+
+    def test_rolled_back_batch_removes_written_files(self):
+        with mock.patch('employees.signals.retain_files', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.post()
+
+        self.assertFalse(EmployeeScreenshot.objects.exists())
+        for name in self.stored_names():
+            self.assertFalse(screenshot_storage.exists(name))
+
+
+class ScreenshotFilesTest(MediaRootMixin, TransactionTestCase):
+
+    def setUp(self):
+        super().setUp()
+        owner = create_user('owner@example.com', is_superuser=True)
+        self.employee = create_employee(create_organization(owner), 'john@example.com')
+
+    def create_screenshot(self, color='red'):
+        return EmployeeScreenshot.objects.create(
+            employee=self.employee, datetime='2020-01-01T10:00:00Z',
+            screenshot=SimpleUploadedFile('shot.png', image_content(color), 'image/png')
+        )
+
+    def ref_count(self, name):
+        return ScreenshotFile.objects.filter(name=name).values_list('ref_count', flat=True).first()
+
+    def test_identical_screenshots_share_one_file(self):
+        first = self.create_screenshot()
+        second = self.create_screenshot()
+
+        self.assertEqual(first.screenshot.name, second.screenshot.name)
+        self.assertEqual(self.ref_count(first.screenshot.name), 2)
+
+    def test_file_is_deleted_with_its_last_reference(self):
+        first = self.create_screenshot()
+        second = self.create_screenshot()
+        name = first.screenshot.name
+
+        first.delete()
+        self.assertTrue(screenshot_storage.exists(name))
+        self.assertEqual(self.ref_count(name), 1)
+
+        second.delete()
+        self.assertFalse(screenshot_storage.exists(name))
+        self.assertIsNone(self.ref_count(name))
+
+    def test_referenced_file_is_not_deleted(self):
+        name = self.create_screenshot().screenshot.name
+
+        delete_unreferenced_file(name)
+
+        self.assertTrue(screenshot_storage.exists(name))
+
+    def test_file_saved_again_before_delete_is_kept(self):
+        screenshot = self.create_screenshot()
+        name = screenshot.screenshot.name
+
+        # the delete scheduled by the release runs after the file was
+        # referenced again
+        with mock.patch('employees.screenshot_files.transaction.on_commit') as on_commit:
+            release_files([name])
+
+        retain_files([screenshot_storage.save('shot.png', ContentFile(image_content()))])
+        on_commit.call_args[0][0]()
+
+        self.assertTrue(screenshot_storage.exists(name))
+        self.assertEqual(self.ref_count(name), 1)
+
+    def test_variants_of_deleted_screenshot_are_discarded(self):
+        screenshot = self.create_screenshot()
+        self.create_screenshot()
+        EmployeeScreenshot.objects.filter(pk=screenshot.pk).delete()
+
+        generate_variants(screenshot)
+
+        for name in (screenshot.thumbnail.name, screenshot.compact.name):
+            self.assertFalse(screenshot_storage.exists(name))
+            self.assertIsNone(self.ref_count(name))
+
+
+class EmployeeImporterTest(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.owner = create_user('owner@example.com', is_superuser=True)
+        self.organization = create_organization(self.owner)
+        self.employee = create_employee(self.organization, 'john@example.com')
+        self.importer = EmployeeImporter(self.organization, self.owner)
+
+    def row(self, email, **values):
+        row = {
+            'email': email, 'first_name': 'Jane', 'last_name': 'Doe',
+            'nationality': self.employee.nationality_id,
+            'designation': self.employee.designation.slug,
+        }
+        row.update(values)
+        return row
+
+    def test_email_differing_in_case_is_rejected(self):
+        report = self.importer.run([self.row('JOHN@example.com'), self.row('jane@example.com')])
+
+        self.assertEqual(report['valid'], 1)
+        self.assertEqual(report['errors'][0]['row'], 1)
+        self.assertIn('email', report['errors'][0]['errors'])
+
+    def test_repeated_email_in_batch_is_rejected(self):
+        report = self.importer.run([self.row('Jane@example.com'), self.row('jane@example.com')])
+
+        self.assertEqual(len(report['created']), 1)
+        self.assertEqual(report['errors'][0]['row'], 2)
+
+    def test_email_is_stored_like_single_create(self):
+        self.importer.run([self.row('Jane@EXAMPLE.com')])
+
+        self.assertTrue(User.objects.filter(email=User.objects.normalize_email('Jane@EXAMPLE.com')).exists())
+
+    def test_rows_that_are_not_objects_are_reported(self):
+        rows = read_rows(io.BytesIO(b'[1, 2]\n"text"\n'), 'employees.jsonl')
+
+        report = self.importer.run(rows + [self.row('jane@example.com')])
+
+        self.assertEqual([error['row'] for error in report['errors']], [1, 2])
+        self.assertEqual(len(report['created']), 1)
+
+    def test_user_created_after_validation_is_reported(self):
+        load_lookups = self.importer.load_lookups
+
+        def stale_lookups(rows):
+            load_lookups(rows)
+            if stale_lookups.first:
+                stale_lookups.first = False
+                self.importer.existing_emails = set()
+        stale_lookups.first = True
+
+        with mock.patch.object(self.importer, 'load_lookups', stale_lookups):
+            report = self.importer.run([self.row('john@example.com'), self.row('jane@example.com')])
+
+        self.assertEqual(report['errors'][0]['row'], 1)
+        self.assertEqual(len(report['created']), 1)
+
+
+class GeoIndexTest(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        geo_index.reset()
+        self.country = Country.objects.create(name='India', name_ascii='India', code2='IN')
+        self.state = State.objects.create(name='Kerala', name_ascii='Kerala', country=self.country)
+        self.city = City.objects.create(name='Kochi', name_ascii='Kochi', country=self.country, region=self.state)
+
+    def test_membership(self):
+        self.assertEqual(geo_index.country_code(self.country.id), 'IN')
+        self.assertTrue(geo_index.state_in_country(self.state.id, self.country.id))
+        self.assertTrue(geo_index.city_in_state(self.city.id, self.state.id))
+        self.assertFalse(geo_index.city_in_state(self.city.id, None))
+
+    def test_state_without_country_matches_missing_country(self):
+        state = State.objects.create(name='Unassigned', name_ascii='Unassigned', country=None)
+
+        self.assertTrue(geo_index.state_in_country(state.id, None))
+        self.assertFalse(geo_index.state_in_country(self.state.id, None))
+        self.assertFalse(geo_index.state_in_country(state.id, self.country.id))
+
+    def test_city_without_region_matches_missing_state(self):
+        city = City.objects.create(name='Other', name_ascii='Other', country=self.country, region=None)
+
+        self.assertTrue(geo_index.city_in_state(city.id, None))
+        self.assertFalse(geo_index.city_in_state(city.id, self.state.id))
+
+    def test_rolled_back_change_keeps_index(self):
+        self.assertTrue(geo_index.state_in_country(self.state.id, self.country.id))
+
+        with mock.patch('employees.geo.reload_geo_index') as reload_geo_index:
+            try:
+                with transaction.atomic():
+                    State.objects.create(name='Rolled back', name_ascii='Rolled back', country=self.country)
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+
+        reload_geo_index.assert_not_called()
+
+
+class EmployeeStatusBulkChangeTest(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.owner = create_user('owner@example.com', is_superuser=True)
+        self.organization = create_organization(self.owner)
+        self.active = create_employee(self.organization, 'john@example.com')
+        self.inactive = create_employee(
+            self.organization, 'jane@example.com', user=create_user('jane@example.com', is_active=False)
+        )
+
+    def post(self, user, status):
+        request = APIRequestFactory().post('/', {
+            'organization': self.organization.slug,
+            'employees': [self.active.slug, self.inactive.slug],
+            'status': status,
+        }, format='json')
+        force_authenticate(request, user)
+
+        return EmployeeViewSet.as_view({'post': 'employee_status_bulk_change'})(request)
+
+    def test_only_changed_employees_are_reported(self):
+        response = self.post(self.owner, 'inactive')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['changed'], [self.active.slug])
+        self.assertEqual(response.data['unchanged'], sorted([self.inactive.slug]))
+        self.assertFalse(User.objects.get(pk=self.active.user_id).is_active)
+
+    def test_employee_without_update_status_is_denied(self):
+        response = self.post(self.active.user, 'active')
+
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(User.objects.get(pk=self.inactive.user_id).is_active)
+
+    def test_employee_with_update_status_changes_status(self):
+        self.active.permission_groups.add(create_permission_group(self.organization, 'update_status'))
+
+        response = self.post(self.active.user, 'active')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['changed'], [self.inactive.slug])
+
+
+class EmployeeQueryPlanTest(TestCase):
+
+    def setUp(self):
+        self.owner = create_user('owner@example.com', is_superuser=True)
+        self.organization = create_organization(self.owner)
+        self.group = create_permission_group(self.organization, 'update_status')
+
+    def add_employees(self, count):
+        for index in range(count):
+            employee = create_employee(self.organization, 'employee%d@example.com' % Employee.objects.count())
+            employee.designation.permission_groups.add(self.group)
+
+    def serialize(self):
+        employees = Employee.objects.for_serializer().filter(organization=self.organization)
+
+        with CaptureQueriesContext(connection) as queries:
+            data = EmployeeSerializer(employees, many=True).data
+
+        return data, len(queries)
+
+    def test_query_count_does_not_grow_with_employees(self):
+        self.add_employees(1)
+        data, one = self.serialize()
+        self.assertEqual(len(data), 1)
+
+        self.add_employees(4)
+        data, many = self.serialize()
+        self.assertEqual(len(data), 5)
+
+        self.assertEqual(one, many)
+
+
+class OwnerEmployeeUpdateTest(TestCase):
+
+    def setUp(self):
+        self.owner = create_user('owner@example.com', is_superuser=True)
+        UserProfile.objects.create(user=self.owner, first_name='John', last_name='Doe')
+        self.employee = create_employee(create_organization(self.owner), 'owner@example.com', user=self.owner)
+
+    def add_organizations(self, count):
+        for index in range(count):
+            create_employee(create_organization(self.owner, 'Other %d' % index), 'owner@example.com', user=self.owner)
+
+    def update(self, first_name):
+        request = Request(APIRequestFactory().patch('/'))
+        request.user = self.owner
+
+        serializer = EmployeeSerializer(
+            Employee.objects.get(pk=self.employee.pk), data={'first_name': first_name},
+            partial=True, context={'request': request}
+        )
+        serializer.is_valid(raise_exception=True)
+
+        with CaptureQueriesContext(connection) as queries:
+            serializer.save()
+
+        return len(queries)
+
+    def test_query_count_does_not_grow_with_organizations(self):
+        self.add_organizations(1)
+        one = self.update('Johnny')
+
+        self.add_organizations(3)
+        many = self.update('Jon')
+
+        self.assertEqual(one, many)
+
+    def test_other_organizations_are_updated(self):
+        self.add_organizations(2)
+        self.update('Johnny')
+
+        others = Employee.objects.filter(user=self.owner).exclude(pk=self.employee.pk)
+        self.assertEqual(set(others.values_list('first_name', flat=True)), {'Johnny'})
+        self.assertEqual(set(others.values_list('updated_by', flat=True)), {self.owner.pk})
+
+
+class RebuildPermissionSetsTest(TestCase):
+
+    def setUp(self):
+        owner = create_user('owner@example.com', is_superuser=True)
+        self.organization = create_organization(owner)
+        self.employee = create_employee(self.organization, 'john@example.com')
+        self.employee.permission_groups.add(create_permission_group(self.organization, 'view_permissions'))
+
+    def test_rebuild_replaces_the_set(self):
+        permission_set = EmployeePermissionSet.objects.get(employee=self.employee)
+        self.assertTrue(permission_set.has_permission('view_permissions'))
+
+        rebuild_permission_sets([self.employee.pk])
+
+        rebuilt = EmployeePermissionSet.objects.get(employee=self.employee)
+        self.assertEqual(rebuilt.version, permission_set.version + 1)
+        self.assertEqual(rebuilt.codenames, 'view_permissions')
+
+    def test_missing_employees_are_skipped(self):
+        rebuild_permission_sets([self.employee.pk, self.employee.pk + 1000])
+
+        self.assertEqual(EmployeePermissionSet.objects.count(), 1)
+
+
+class SearchEmployeesTest(TestCase):
+
+    def setUp(self):
+        owner = create_user('owner@example.com', is_superuser=True)
+        self.organization = create_organization(owner)
+        self.john = create_employee(self.organization, 'john.doe@example.com', 'John', 'Doe')
+        self.jane = create_employee(self.organization, 'jane@corp.example.com', 'Jane', 'Roe')
+
+    def search(self, q):
+        return set(search_employees(Employee.objects.all(), self.organization, q))
+
+    def test_substrings_of_names_and_email_match(self):
+        self.assertEqual(self.search('ohn'), {self.john})
+        self.assertEqual(self.search('JOHN D'), {self.john})
+        self.assertEqual(self.search('n Do'), {self.john})
+        self.assertEqual(self.search('e@corp'), {self.jane})
+        self.assertEqual(self.search('example'), {self.john, self.jane})
+        self.assertEqual(self.search('oe'), {self.john, self.jane})
+
+    def test_non_matching_query_returns_nothing(self):
+        self.assertEqual(self.search('johnny'), set())
+        self.assertEqual(self.search('Doe Jo'), set())
+
+    def test_other_organizations_are_not_matched(self):
+        other = create_organization(self.organization.created_by, 'Other')
+        create_employee(other, 'john@other.example.com', 'John', 'Smith')
+
+        queryset = Employee.objects.filter(organization=self.organization)
+        self.assertEqual(set(search_employees(queryset, self.organization, 'john')), {self.john})
+
+    def test_renamed_employee_is_found_by_new_name(self):
+        self.john.first_name = 'Jonathan'
+        self.john.save()
+
+        self.assertEqual(self.search('athan'), {self.john})
+        self.assertEqual(self.search('john'), set())
+
+    def test_changed_email_is_found(self):
+        user = self.jane.user
+        user.email = 'jane.smith@example.com'
+        user.save()
+
+        self.assertEqual(self.search('smith'), {self.jane})
+
+    def test_user_save_without_email_change_does_not_reindex(self):
+        user = User.objects.get(pk=self.john.user_id)
+
+        with mock.patch('employees.signals.index_employees') as index_employees:
+            user.save()
+            user.save(update_fields=['last_login'])
+
+        index_employees.assert_not_called()
+
+
+class AuthenticateRememberedTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = create_user('john@example.com', 'secret')
+
+    def test_rejected_pair_is_refused_without_hashing(self):
+        self.assertIsNone(authenticate_remembered('john@example.com', 'wrong'))
+
+        with mock.patch('employees.login.authenticate') as authenticate:
+            self.assertIsNone(authenticate_remembered('john@example.com', 'wrong'))
+
+        authenticate.assert_not_called()
+        self.assertEqual(authenticate_remembered('john@example.com', 'secret'), self.user)
+
+    def test_password_change_forgets_rejected_pairs(self):
+        self.assertIsNone(authenticate_remembered('john@example.com', 'new-secret'))
+
+        self.user.set_password('new-secret')
+        self.user.save()
+
+        self.assertEqual(authenticate_remembered('john@example.com', 'new-secret'), self.user)
+
+    def test_activation_forgets_rejected_pairs(self):
+        self.user.is_active = False
+        self.user.save()
+        self.assertIsNone(authenticate_remembered('john@example.com', 'secret'))
+
+        owner = create_user('owner@example.com', is_superuser=True)
+        employee = create_employee(create_organization(owner), 'john@example.com', user=self.user)
+
+        request = APIRequestFactory().post('/')
+        force_authenticate(request, owner)
+        EmployeeViewSet.as_view({'post': 'employee_status_change'})(request, slug=employee.slug)
+
+        self.assertEqual(authenticate_remembered('john@example.com', 'secret'), User.objects.get(pk=self.user.pk))
+
+
+class CachedTokenAuthenticationTest(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        token_cache.clear()
+        self.user = create_user('john@example.com')
+        self.token = Token.objects.create(user=self.user)
+
+    def authenticate(self):
+        return CachedTokenAuthentication().authenticate_credentials(self.token.key)[0]
+
+    def test_tokens_are_read_from_database_without_shared_cache(self):
+        for _ in range(2):
+            with self.assertNumQueries(1):
+                self.authenticate()
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_process_local_shared_cache_is_refused(self):
+        with mock.patch('employees.authentication.SHARED_CACHE', 'default'):
+            with self.assertRaises(ImproperlyConfigured):
+                shared_cache_enabled()
+
+    @mock.patch('employees.authentication.CACHE_ENABLED', True)
+    @mock.patch('employees.authentication.SHARED_CACHE', 'default')
+    def test_deactivated_user_is_refused_at_once(self):
+        self.authenticate()
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.authenticate(), self.user)
+
+        self.user.is_active = False
+        self.user.save()
+
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            self.authenticate()
+
+    @mock.patch('employees.authentication.CACHE_ENABLED', True)
+    @mock.patch('employees.authentication.SHARED_CACHE', 'default')
+    def test_deleted_token_is_refused_at_once(self):
+        self.authenticate()
+
+        self.token.delete()
+
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            self.authenticate()
+
+
+class OutboxTest(TransactionTestCase):
+
+    def setUp(self):
+        self.outbox_email = queue_email('Subject', ['john@example.com'], body='Body')
+
+    def refresh(self):
+        return OutboxEmail.objects.get(pk=self.outbox_email.pk)
+
+    def test_pending_email_is_sent_outside_a_transaction(self):
+        in_transaction = []
+        send = mail.EmailMultiAlternatives.send
+
+        def tracked_send(message, *args, **kwargs):
+            in_transaction.append(connection.in_atomic_block)
+            return send(message, *args, **kwargs)
+
+        with mock.patch.object(mail.EmailMultiAlternatives, 'send', tracked_send):
+            self.assertEqual(send_pending_emails(), 1)
+
+        self.assertEqual(in_transaction, [False])
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(self.refresh().status, 'sent')
+
+    def test_failed_email_is_retried_later(self):
+        with mock.patch.object(mail.EmailMultiAlternatives, 'send', side_effect=OSError('refused')):
+            self.assertEqual(send_pending_emails(), 0)
+
+        outbox_email = self.refresh()
+        self.assertEqual(outbox_email.status, 'pending')
+        self.assertEqual(outbox_email.attempts, 1)
+        self.assertGreater(outbox_email.next_attempt_at, timezone.now())
+
+    def test_claimed_email_is_left_to_its_sender(self):
+        self.assertEqual(claim_emails(10), [self.outbox_email])
+        self.assertEqual(self.refresh().status, 'sending')
+
+        self.assertEqual(send_pending_emails(), 0)
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_expired_claim_is_claimed_again(self):
+        claim_emails(10)
+        OutboxEmail.objects.filter(pk=self.outbox_email.pk).update(next_attempt_at=timezone.now())
+
+        self.assertEqual(send_pending_emails(), 1)
+        self.assertEqual(self.refresh().status, 'sent')
+
+
+class ScreenshotLookupScopeTest(TestCase):
+
+    def setUp(self):
+        self.owner = create_user('owner@example.com', is_superuser=True)
+        self.organization = create_organization(self.owner)
+        self.employee = create_employee(self.organization, 'john@example.com')
+
+        other_owner = create_user('other@example.com', is_superuser=True)
+        self.other_organization = create_organization(other_owner, 'Other')
+        self.other_employee = create_employee(self.other_organization, 'jane@example.com')
+
+    def validate(self, serializer_class, user, data):
+        request = Request(APIRequestFactory().post('/'))
+        request.user = user
+
+        return serializer_class(data=data, context={'request': request})
+
+    def range_data(self, employee):
+        end = timezone.now()
+        return {
+            'employee': employee.slug,
+            'start': end - timedelta(hours=1),
+            'end': end,
+        }
+
+    def test_range_accepts_employee_of_own_organization(self):
+        for user in (self.owner, self.employee.user):
+            serializer = self.validate(EmployeeScreenshotRangeSerializer, user, self.range_data(self.employee))
+
+            self.assertTrue(serializer.is_valid(), serializer.errors)
+
+    def test_range_rejects_employee_of_another_organization(self):
+        for user in (self.owner, self.employee.user):
+            serializer = self.validate(EmployeeScreenshotRangeSerializer, user, self.range_data(self.other_employee))
+
+            self.assertFalse(serializer.is_valid())
+            self.assertIn('employee', serializer.errors)
+
+    def test_latest_rejects_another_organization(self):
+        serializer = self.validate(
+            EmployeeScreenshotOrganizationSerializer, self.employee.user,
+            {'organization': self.other_organization.slug}
+        )
+
+        self.assertFalse(serializer.is_valid())
+        self.assertIn('organization', serializer.errors)
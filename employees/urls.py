@@ -9,13 +9,16 @@ app_name = 'employees'
 
 urlpatterns = [
     path('employee-api-login/', views.EmployeeAPILogin.as_view()),
+    path('token-cache-stats/', views.TokenCacheStatsAPIView.as_view()),
     path('create-employee-screenshot/', views.EmployeeScreenshotCreateAPIView.as_view()),
+    path('create-employee-screenshots/', views.EmployeeScreenshotBatchCreateAPIView.as_view()),
     path('employee-email-verification/<uidb64>/<token>/', views.EmployeeEmailVerificationView.as_view())
 ]
 
 router = DefaultRouter()
 router.register(r'employees', views.EmployeeViewSet, basename='employee'),
 router.register(r'search-employees', views.EmployeesSearchViewSet, basename='search_employees')
+router.register(r'employee-screenshots', views.EmployeeScreenshotViewSet, basename='employee_screenshots')
 
 
 urlpatterns += router.urls
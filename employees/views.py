@@ -1,32 +1,46 @@
-from django.db import transaction
+import json
+
+from django.db import transaction, connection
+from django.db.models import OuterRef, Subquery
+from django.http import StreamingHttpResponse
+from django.core.serializers.json import DjangoJSONEncoder
 from django.utils.http import urlsafe_base64_decode
 from django.utils.encoding import force_bytes, force_text
 from django.shortcuts import get_object_or_404
-from django.db.models import Value as V
-from django.db.models.functions import Concat
-from django.db.models import Q
 
 from general.token_generator import account_activation_token, password_reset_token
 
 
 from rest_framework.authtoken.models import Token
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import PageNumberPagination, CursorPagination
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework import generics
-from rest_framework.authentication import TokenAuthentication
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework import viewsets
 from rest_framework.decorators import action
+from rest_framework.parsers import MultiPartParser
 
 
 
 from general.permissions import CustomModelPermissions, IsObjectUser, ListOrCreatePermission
-from .models import Employee, EmployeeScreenshot
+from .permissions import user_has_permission
+from .authentication import CachedTokenAuthentication, token_cache, invalidate_user_tokens
+from .login import password_changed
+from .models import Employee, EmployeeScreenshot, OutboxEmail
+from .search import search_employees
+from .screenshot_variants import schedule_variants
+from .screenshot_files import retain_files, discard_files
+from .bulk_import import EmployeeImporter, read_rows
+from departments.org_chart import invalidate_organization_chart
+from departments.fieldsets import expanded_sections
 from accounts.serializers import UserSerializer
 from .serializers import EmployeeSerializer, EmployeeLoginSerializer, EmployeeScreenshotSerializer, \
-InviteEmployeeSerializer, EmployeeListSerializer, EmployeePermissionSerializer
+InviteEmployeeSerializer, EmployeeListSerializer, EmployeePermissionSerializer, \
+EmployeeScreenshotBatchItemSerializer, EmployeeScreenshotRangeSerializer, \
+EmployeeScreenshotOrganizationSerializer, EmployeeImportSerializer, \
+EmployeeStatusBulkChangeSerializer
 
 from accounts.models import User
 
@@ -37,12 +51,69 @@ class StandardResultsSetPagination(PageNumberPagination):
     max_page_size = 1000
 
 
-class EmployeeViewSet(viewsets.ModelViewSet):
+class EmployeeCursorPagination(CursorPagination):
+    """Keyset pagination seeking on employee id, the total count is only
+    computed when requested with ?total=capped and stops at total_cap
+    """
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    ordering = 'id'
+    total_query_param = 'total'
+    total_cap = 10000
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.total = None
+
+        if request.query_params.get(self.total_query_param) == 'capped':
+            self.total = queryset.order_by()[:self.total_cap + 1].count()
+
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+
+        if self.total is not None:
+            response.data['count'] = min(self.total, self.total_cap)
+            response.data['count_is_capped'] = self.total > self.total_cap
+
+        return response
+
+
+class CursorPaginationMixin:
+    """Switches a viewset to cursor pagination when requested
+    with ?pagination=cursor
+    """
+    cursor_pagination_class = EmployeeCursorPagination
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            if self.request.query_params.get('pagination') == 'cursor':
+                self._paginator = self.cursor_pagination_class()
+            elif self.pagination_class is None:
+                self._paginator = None
+            else:
+                self._paginator = self.pagination_class()
+
+        return self._paginator
+
+
+class ScreenshotCursorPagination(CursorPagination):
+    """Keyset pagination of screenshots in time order
+    """
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    ordering = ('datetime', 'id')
+
+
+class EmployeeViewSet(CursorPaginationMixin, viewsets.ModelViewSet):
     """create, update, delete, retirve employees of an organization
     """
     serializer_class = EmployeeSerializer
-    queryset = Employee.objects.all()
-    authentication_classes = [TokenAuthentication]
+    queryset = Employee.objects.select_related('user')
+    authentication_classes = [CachedTokenAuthentication]
 
     # permission_classes = [IsAuthenticated, CustomModelPermissions, 
     # IsObjectUser, ListOrCreatePermission]
@@ -97,6 +168,37 @@ class EmployeeViewSet(viewsets.ModelViewSet):
 
             return Response(data, status=status.HTTP_400_BAD_REQUEST)
 
+    @action(methods=['post'], detail=False, url_path='bulk-import')
+    def bulk_import(self, request):
+        """Create employees of an organization from a csv or jsonl file and
+        send invitation emails, returns a per row error report
+        """
+        serializer = EmployeeImportSerializer(data=request.data)
+
+        if serializer.is_valid():
+
+            invite_serializer = InviteEmployeeSerializer(data=request.data)
+            invite_serializer.is_valid()
+
+            file = serializer.validated_data['file']
+
+            try:
+                rows = read_rows(file, file.name)
+            except (ValueError, UnicodeDecodeError):
+                data = {'file': ['Unable to read file']}
+                return Response(data, status=status.HTTP_400_BAD_REQUEST)
+
+            importer = EmployeeImporter(
+                serializer.validated_data['organization'],
+                request.user,
+                invite_serializer
+            )
+            report = importer.run(rows, dry_run=serializer.validated_data['dry_run'])
+
+            return Response(report)
+        else:
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
     @action(methods=['post'], detail=False, url_path='organization-employees')
     def organization_employees(self, request):
         serializer = EmployeeListSerializer(data=request.data)
@@ -106,7 +208,8 @@ class EmployeeViewSet(viewsets.ModelViewSet):
             organization_slug = serializer.data.get('organization')
 
             branch_slug = serializer.data.get('branch')
-            employees = Employee.objects.filter(
+            expand = expanded_sections(request, EmployeeSerializer.expandable_fields)
+            employees = Employee.objects.for_serializer(expand).filter(
                     organization__slug=organization_slug,user__is_active=True, invitation_accepted=True
                 )
 
@@ -151,20 +254,93 @@ class EmployeeViewSet(viewsets.ModelViewSet):
         else:
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    @action(methods=['get'], detail=True, url_path='invitation-status')
+    def invitation_status(self, request, slug=None):
+        """delivery status of the latest invitation email of an employee
+        """
+        employee = self.get_object()
+
+        outbox_email = OutboxEmail.objects.filter(
+            reference='employee-invitation:%s' % employee.slug
+        ).order_by('-created').first()
+
+        if outbox_email is None:
+            data = {'detail': 'Not found'}
+            return Response(data, status=status.HTTP_404_NOT_FOUND)
+
+        return Response({
+            'status': outbox_email.status,
+            'attempts': outbox_email.attempts,
+            'sent_at': outbox_email.sent_at,
+            'last_error': outbox_email.last_error
+        })
+
     @action(methods=['post'], detail=True, url_path='employee-status-change')
     def employee_status_change(self, request, slug=None):
 
         employee = self.get_object()
-        if employee.employee_status == 'Active':
-            employee.user.is_active = False
-            employee.user.save()
+        user = employee.user
 
-        else:
-            employee.user.is_active = True
-            employee.user.save()
+        user.is_active = employee.employee_status != 'Active'
+        user.save()
+
+        # a correct password refused while the status differed is forgotten
+        password_changed(user.email)
 
         return Response({'status': 'success'})
 
+    @action(methods=['post'], detail=False, url_path='employee-status-bulk-change')
+    def employee_status_bulk_change(self, request):
+        """activate or deactivate employees of an organization in one
+        transaction, owners and employees yet to accept their invitation
+        are left unchanged
+        """
+        serializer = EmployeeStatusBulkChangeSerializer(data=request.data)
+
+        if serializer.is_valid():
+
+            organization = serializer.validated_data['organization']
+            slugs = set(serializer.validated_data['employees'])
+            is_active = serializer.validated_data['status'] == 'active'
+
+            if not user_has_permission(request.user, organization.pk, 'update_status', request):
+                self.permission_denied(request, message='You do not have permission to update status.')
+
+            with transaction.atomic():
+                employees = Employee.objects.filter(
+                    organization=organization,
+                    slug__in=slugs,
+                    invitation_accepted=True,
+                    user__is_superuser=False
+                ).select_for_update()
+
+                slugs_by_user = dict(employees.values_list('user_id', 'slug'))
+
+                # only users whose status differs are changed and reported
+                emails = dict(User.objects.filter(
+                    id__in=slugs_by_user, is_active=not is_active
+                ).select_for_update().values_list('id', 'email'))
+
+                User.objects.filter(id__in=emails).update(is_active=is_active)
+
+            changed = {slugs_by_user[user_id] for user_id in emails}
+
+            # update() skips post_save, cached tokens, remembered failed
+            # logins and the organization chart are dropped here
+            if emails:
+                invalidate_user_tokens(emails)
+                for email in emails.values():
+                    password_changed(email)
+                invalidate_organization_chart([organization.pk])
+
+            return Response({
+                'status': 'success',
+                'changed': sorted(changed),
+                'unchanged': sorted(slugs - set(changed))
+            })
+        else:
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
 
 class EmployeeAPILogin(APIView):
     """Employee Login API view
@@ -190,15 +366,123 @@ class EmployeeAPILogin(APIView):
                 status=status.HTTP_400_BAD_REQUEST)
 
 
+class TokenCacheStatsAPIView(APIView):
+    """Returns hit, miss and eviction counters of this process's token cache
+    """
+    permission_classes = (IsAdminUser,)
+    authentication_classes = (CachedTokenAuthentication,)
+
+    def get(self, request):
+        return Response(token_cache.stats())
+
+
 class EmployeeScreenshotCreateAPIView(generics.CreateAPIView):
     """API view to create new screenshort instance in database
     input fields are employee slug, screenshort, datetime
     """
     permission_classes = (IsAuthenticated,)
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     serializer_class = EmployeeScreenshotSerializer
 
 
+class EmployeeScreenshotBatchCreateAPIView(APIView):
+    """API view to create many screenshot instances in one request
+    input fields are repeated slug, datetime, screenshot values matched by
+    position, a single slug applies to every screenshot of the batch
+    """
+    permission_classes = (IsAuthenticated,)
+    authentication_classes = (CachedTokenAuthentication,)
+    # repeated fields are read with getlist, other content types get a 415
+    parser_classes = (MultiPartParser,)
+    max_batch_size = 200
+
+    def post(self, request):
+        screenshots = request.FILES.getlist('screenshot')
+        datetimes = request.data.getlist('datetime')
+        slugs = request.data.getlist('slug')
+
+        if len(slugs) == 1:
+            slugs = slugs * len(screenshots)
+
+        if not screenshots or not (len(screenshots) == len(datetimes) == len(slugs)):
+            data = {
+                'error': 'slug, datetime and screenshot must be given for every screenshot'
+            }
+            return Response(data, status=status.HTTP_400_BAD_REQUEST)
+
+        if len(screenshots) > self.max_batch_size:
+            data = {
+                'error': 'A batch can contain at most %s screenshots' % self.max_batch_size
+            }
+            return Response(data, status=status.HTTP_400_BAD_REQUEST)
+
+        # resolving every employee of the batch with a single query
+        employees = Employee.objects.only('id', 'slug').in_bulk(set(slugs), field_name='slug')
+
+        results = []
+        screenshot_objs = []
+
+        for index, item in enumerate(zip(slugs, datetimes, screenshots)):
+            slug, datetime, screenshot = item
+
+            serializer = EmployeeScreenshotBatchItemSerializer(data={
+                'slug': slug,
+                'datetime': datetime,
+                'screenshot': screenshot
+            })
+
+            if not serializer.is_valid():
+                results.append({'index': index, 'status': 'error', 'errors': serializer.errors})
+                continue
+
+            employee = employees.get(slug)
+
+            if employee is None:
+                results.append({'index': index, 'status': 'error', 'errors': {'slug': ['Invalid employee']}})
+                continue
+
+            screenshot_obj = EmployeeScreenshot(
+                employee=employee,
+                datetime=serializer.validated_data['datetime'],
+                screenshot=serializer.validated_data['screenshot']
+            )
+            screenshot_objs.append(screenshot_obj)
+            results.append({'index': index, 'status': 'created', 'screenshot': screenshot_obj})
+
+        # files are written by the image field while building the insert
+        try:
+            with transaction.atomic():
+                if connection.features.can_return_ids_from_bulk_insert:
+                    EmployeeScreenshot.objects.bulk_create(screenshot_objs)
+
+                    # bulk_create skips post_save, so files are retained and
+                    # variants are queued here
+                    retain_files([screenshot_obj.screenshot.name for screenshot_obj in screenshot_objs])
+                    schedule_variants([screenshot_obj.id for screenshot_obj in screenshot_objs])
+                else:
+                    # without ids from the insert every row is saved on its own
+                    for screenshot_obj in screenshot_objs:
+                        screenshot_obj.save()
+        except Exception:
+            # a rolled back insert leaves the written files without a reference
+            discard_files([
+                screenshot_obj.screenshot.name for screenshot_obj in screenshot_objs
+                if screenshot_obj.screenshot._committed
+            ])
+            raise
+
+        for result in results:
+            if 'screenshot' in result:
+                result['id'] = result.pop('screenshot').id
+
+        if screenshot_objs:
+            response_status = status.HTTP_201_CREATED
+        else:
+            response_status = status.HTTP_400_BAD_REQUEST
+
+        return Response({'results': results}, status=response_status)
+
+
 class EmployeeEmailVerificationView(APIView):
     """ Confirming registration via link provided in email"""
 
@@ -218,6 +502,7 @@ class EmployeeEmailVerificationView(APIView):
             employee_obj.invitation_accepted = True
             employee_obj.save()
             user.save()
+            password_changed(user.email)
 
             token, created = Token.objects.get_or_create(user=user)
 
@@ -240,12 +525,12 @@ class EmployeeEmailVerificationView(APIView):
             return Response(data, status=status.HTTP_400_BAD_REQUEST)
 
 
-class EmployeesSearchViewSet(viewsets.ModelViewSet):
+class EmployeesSearchViewSet(CursorPaginationMixin, viewsets.ModelViewSet):
     """search and filtering employees of an organization ,branch,department
     """
     serializer_class = EmployeeListSerializer
     queryset = Employee.objects.all()
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [CachedTokenAuthentication]
     permission_classes = [IsAuthenticated, CustomModelPermissions, IsObjectUser, ListOrCreatePermission]
     lookup_field = 'slug'
     pagination_class = StandardResultsSetPagination
@@ -261,7 +546,9 @@ class EmployeesSearchViewSet(viewsets.ModelViewSet):
 
         if serializer.is_valid():
 
-            queryset = self.get_queryset()
+            queryset = self.get_queryset().for_serializer(
+                expanded_sections(request, EmployeeSerializer.expandable_fields)
+            )
 
             organization_slug = serializer.data.get('organization')
 
@@ -293,9 +580,8 @@ class EmployeesSearchViewSet(viewsets.ModelViewSet):
             q = self.request.POST.get('q', None)
 
             if q:
-                queryset = queryset.annotate(
-                    search=Concat('first_name', V(' '), 'last_name')
-                ).filter(Q(search__icontains=q) | Q(user__email__icontains=q))
+                organization = serializer.validated_data.get('organization')
+                queryset = search_employees(queryset, organization, q)
 
             department_slug = self.request.POST.get('department', None)
             if department_slug:
@@ -303,7 +589,7 @@ class EmployeesSearchViewSet(viewsets.ModelViewSet):
 
             page = self.paginate_queryset(queryset)
             if page is not None:
-                serializer = EmployeeSerializer(page, many=True)
+                serializer = EmployeeSerializer(page, many=True, context=self.get_serializer_context())
 
                 data = {}
 
@@ -313,8 +599,91 @@ class EmployeesSearchViewSet(viewsets.ModelViewSet):
 
                 return Response(data)
 
-            serializer = EmployeeSerializer(queryset, many=True)
+            serializer = EmployeeSerializer(queryset, many=True, context=self.get_serializer_context())
 
             return Response(serializer.data)
         else:
             return Response(serializer.errors)
+
+
+class EmployeeScreenshotViewSet(viewsets.ReadOnlyModelViewSet):
+    """listing screenshots of an employee in a time range and latest
+    screenshots of an organization
+    """
+    serializer_class = EmployeeScreenshotSerializer
+    queryset = EmployeeScreenshot.objects.select_related('employee')
+    authentication_classes = [CachedTokenAuthentication]
+    permission_classes = [IsAuthenticated, CustomModelPermissions, IsObjectUser, ListOrCreatePermission]
+    pagination_class = ScreenshotCursorPagination
+
+    def list(self, request):
+        data = {'detail': 'Not found'}
+        return Response(data, status=status.HTTP_404_NOT_FOUND)
+
+    def stream_response(self, queryset):
+        """Streams screenshots as newline delimited json without loading the
+        whole result in memory
+        """
+        def rows():
+            for screenshot in queryset.iterator(chunk_size=500):
+                data = self.get_serializer(screenshot).data
+                yield json.dumps(data, cls=DjangoJSONEncoder) + '\n'
+
+        return StreamingHttpResponse(rows(), content_type='application/x-ndjson')
+
+    @action(methods=['post'], detail=False, url_path='employee-screenshots')
+    def employee_screenshots(self, request):
+        """screenshots of an employee between start and end, paged on
+        (datetime, id) or streamed with ?stream=true
+        """
+        serializer = EmployeeScreenshotRangeSerializer(data=request.data, context={'request': request})
+
+        if serializer.is_valid():
+
+            queryset = self.get_queryset().filter(
+                employee=serializer.validated_data['employee'],
+                datetime__gte=serializer.validated_data['start'],
+                datetime__lt=serializer.validated_data['end']
+            )
+
+            if request.query_params.get('stream') == 'true':
+                return self.stream_response(queryset.order_by('datetime', 'id'))
+
+            page = self.paginate_queryset(queryset)
+            serializer = self.get_serializer(page, many=True)
+
+            return self.get_paginated_response(serializer.data)
+        else:
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    @action(methods=['post'], detail=False, url_path='latest-screenshots')
+    def latest_screenshots(self, request):
+        """latest screenshot of every employee of an organization, each
+        employee costs one (employee, datetime) index probe
+        """
+        serializer = EmployeeScreenshotOrganizationSerializer(data=request.data, context={'request': request})
+
+        if serializer.is_valid():
+
+            latest = EmployeeScreenshot.objects.filter(
+                employee=OuterRef('pk')
+            ).order_by('-datetime').values('id')[:1]
+
+            latest_ids = Employee.objects.filter(
+                organization=serializer.validated_data['organization']
+            ).annotate(
+                latest_screenshot=Subquery(latest)
+            ).filter(
+                latest_screenshot__isnull=False
+            ).values('latest_screenshot')
+
+            queryset = self.get_queryset().filter(id__in=latest_ids).order_by('employee_id')
+
+            if request.query_params.get('stream') == 'true':
+                return self.stream_response(queryset)
+
+            serializer = self.get_serializer(queryset, many=True)
+
+            return Response(serializer.data)
+        else:
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)